@@ -1,27 +1,41 @@
-from flask import Flask, Response, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 import redis
 import json
-import logging
 import os
-import uuid
-from redis import Redis
-from rq import Queue, Worker
-from summarizer.core import run_summarize_files_from_s3  # Updated import
-import asyncio
+import threading
+import time
+from summarizer.cache import CACHE_STATS_KEY
+from summarizer.progress import progress_key, read_progress, results_key
+from summarizer.metrics import read_histograms, read_throughput
+from summarizer.submission import build_job, job_key, submit_jobs
+from result_stream import ResultStreamHub, follow
 from dotenv import load_dotenv
+from logger import setup_logger
 
 load_dotenv()
 
 app = Flask(__name__)
 
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
+logger = setup_logger(__name__)
 
 redis_url = os.getenv('REDIS_URL', 'redis://localhost:6379')
 redis_client = redis.Redis.from_url(redis_url)
-queue_name = 'default'
-results_key = 'summarization_results'
-benchmark_key = 'summarization_benchmark'
+MAX_BATCH_JOBS = 1000
+SUMMARIES_PAGE_SIZE = 100
+SUMMARIES_MAX_PAGE_SIZE = 1000
+# Shared by every /stream_summaries client in this process.
+stream_hub = ResultStreamHub(redis_url)
+# Each open stream holds one gunicorn thread (the Procfile's WEB_THREADS) for as
+# long as it lasts. At most MAX_STREAMS run at once per process, so the other
+# endpoints always keep the rest; further streams get 503 with Retry-After.
+# Streams are also closed after STREAM_MAX_SECONDS. SSE clients reconnect on
+# their own with Last-Event-ID, and NDJSON clients get a final "timeout" line
+# with the cursor to resume from.
+WEB_THREADS = int(os.getenv('WEB_THREADS', 100))
+MAX_STREAMS = int(os.getenv('MAX_STREAMS', max(1, WEB_THREADS // 2)))
+STREAM_MAX_SECONDS = float(os.getenv('STREAM_MAX_SECONDS', 600))
+STREAM_RETRY_AFTER = 5
+stream_slots = threading.BoundedSemaphore(MAX_STREAMS)
 
 # Remove the CONFIG SET command
 # redis_client.config_set('maxmemory-policy', 'allkeys-lru')
@@ -29,30 +43,50 @@ benchmark_key = 'summarization_benchmark'
 @app.route('/summarize', methods=['POST'])
 def summarize():
     try:
-        data = request.json
-        logger.info(f"Received request body: {data}")
-        bucket_name = data['bucket_name']
-        prefix = data.get('prefix', '')
-        max_files = data.get('max_files', 100)
-
-        job_id = str(uuid.uuid4())
-        job_data = {
-            'id': job_id,
-            'bucket_name': bucket_name,
-            'prefix': prefix,
-            'max_files': max_files
-        }
+        try:
+            job_data = build_job(request.json)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-        # Set expiration time for job data (e.g., 1 hour)
-        redis_client.rpush(queue_name, json.dumps(job_data))
-        redis_client.set(f"job:{job_id}", json.dumps(job_data), ex=3600)
-        logger.info(f"Job enqueued: {job_data}")
+        [(job_id, status)] = submit_jobs(redis_client, [job_data], [request.headers.get('Idempotency-Key')])
+        logger.info(f"Job {status}: {job_id} ({job_data['bucket_name']}/{job_data['prefix']})")
 
-        return jsonify({'job_id': job_id}), 202
+        return jsonify({'job_id': job_id, 'status': status}), 202
     except Exception as e:
         logger.error(f"Error in summarize endpoint: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/summarize_batch', methods=['POST'])
+def summarize_batch():
+    try:
+        data = request.json
+        requests_ = data.get('jobs') if isinstance(data, dict) else None
+        if not requests_ or not isinstance(requests_, list):
+            return jsonify({'error': "Missing 'jobs' list in request"}), 400
+        if len(requests_) > MAX_BATCH_JOBS:
+            return jsonify({'error': f"At most {MAX_BATCH_JOBS} jobs per batch"}), 400
+
+        jobs = []
+        for i, job_request in enumerate(requests_):
+            try:
+                jobs.append(build_job(job_request))
+            except ValueError as e:
+                return jsonify({'error': f"Job {i}: {str(e)}"}), 400
+
+        # Each job may carry its own idempotency key; a request-level
+        # Idempotency-Key header covers the whole batch, job by job.
+        batch_key = request.headers.get('Idempotency-Key')
+        idempotency_keys = [job_request.get('idempotency_key') or (f"{batch_key}:{i}" if batch_key else None)
+                            for i, job_request in enumerate(requests_)]
+        results = submit_jobs(redis_client, jobs, idempotency_keys)
+        enqueued = sum(1 for _, status in results if status == 'enqueued')
+        logger.info(f"Batch of {len(jobs)} jobs submitted: {enqueued} enqueued, {len(jobs) - enqueued} reused")
+
+        return jsonify({'jobs': [{'job_id': job_id, 'status': status} for job_id, status in results]}), 202
+    except Exception as e:
+        logger.error(f"Error in summarize_batch endpoint: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.route('/get_summaries', methods=['GET'])
 def get_summaries():
     try:
@@ -64,49 +98,148 @@ def get_summaries():
         if not job_id:
             return jsonify({"error": "Missing 'job_id' in request"}), 400
 
-        # Fetch summarized data from Redis using the job ID
-        redis_key = f"{results_key}:{job_id}"
-        logger.info(f"Fetching summaries from Redis with key: {redis_key}")
-        summaries = redis_client.get(redis_key)
-        if not summaries:
+        # Page through the job's results stream; pass the returned next_cursor
+        # back as `cursor` to continue after the last summary seen.
+        cursor = data.get('cursor')
+        try:
+            limit = min(max(int(data.get('limit', SUMMARIES_PAGE_SIZE)), 1), SUMMARIES_MAX_PAGE_SIZE)
+        except ValueError:
+            return jsonify({"error": "'limit' must be an integer"}), 400
+
+        redis_key = results_key(job_id)
+        logger.info(f"Fetching summaries from Redis with key: {redis_key}, cursor: {cursor}")
+        with redis_client.pipeline(transaction=False) as pipe:
+            pipe.xrange(redis_key, min=f"({cursor}" if cursor else '-', max='+', count=limit)
+            pipe.hgetall(progress_key(job_id))
+            entries, progress = pipe.execute()
+        if not entries and not progress:
             logger.warning(f"No summaries found for job ID: {job_id}")
             return jsonify({"error": "No summaries found for the given job ID"}), 404
 
-        summaries = json.loads(summaries)
-        return jsonify(summaries)
+        summaries = [
+            {
+                "id": entry_id.decode('utf-8'),
+                "file_key": fields[b'file_key'].decode('utf-8'),
+                "summary_key": fields[b'summary_key'].decode('utf-8'),
+                "summary": json.loads(fields[b'summary'])
+            }
+            for entry_id, fields in entries
+        ]
+        next_cursor = summaries[-1]["id"] if summaries else cursor
+        return jsonify({
+            "summaries": summaries,
+            "next_cursor": next_cursor,
+            "has_more": len(summaries) == limit,
+            "progress": read_progress(progress) if progress else None
+        })
     except Exception as e:
         logger.error(f"Error in get_summaries: {str(e)}")
         return jsonify({"error": "Failed to fetch summaries"}), 500
 
 
 
+@app.route('/stream_summaries', methods=['GET'])
+def stream_summaries():
+    job_id = request.args.get('job_id')
+    if not job_id:
+        return jsonify({"error": "Missing 'job_id' in request"}), 400
+    # EventSource clients resume with Last-Event-ID; others pass the last id as `cursor`.
+    cursor = request.headers.get('Last-Event-ID') or request.args.get('cursor')
+    stream_format = request.args.get('format', 'sse')
+    if stream_format not in ('sse', 'ndjson'):
+        return jsonify({"error": "'format' must be 'sse' or 'ndjson'"}), 400
+    # Submission marks a job queued; the job record also covers jobs queued before it did.
+    if (not redis_client.exists(results_key(job_id), job_key(job_id))
+            and not redis_client.hexists('job_status', job_id)):
+        return jsonify({"error": "Unknown job ID"}), 404
+
+    if not stream_slots.acquire(blocking=False):
+        logger.warning(f"Rejecting stream for job {job_id}: {MAX_STREAMS} streams already open")
+        return (jsonify({"error": "Too many open streams; retry later"}), 503,
+                {'Retry-After': str(STREAM_RETRY_AFTER)})
+    deadline = time.monotonic() + STREAM_MAX_SECONDS
+
+    def generate_sse():
+        yield "retry: 3000\n\n"
+        for event in follow(redis_client, stream_hub, job_id, cursor):
+            if time.monotonic() > deadline:
+                return
+            if event[0] == "summary":
+                yield f"id: {event[1]}\nevent: summary\ndata: {json.dumps(event[2], ensure_ascii=False)}\n\n"
+            elif event[0] == "keepalive":
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: end\ndata: {json.dumps(event[1])}\n\n"
+
+    def generate_ndjson():
+        last_id = cursor
+        for event in follow(redis_client, stream_hub, job_id, cursor):
+            if time.monotonic() > deadline:
+                yield json.dumps({"type": "timeout", "cursor": last_id}) + "\n"
+                return
+            if event[0] == "summary":
+                last_id = event[1]
+                yield json.dumps({"type": "summary", "id": event[1], **event[2]}, ensure_ascii=False) + "\n"
+            elif event[0] == "keepalive":
+                yield "\n"
+            else:
+                yield json.dumps({"type": "end", "status": event[1]}) + "\n"
+
+    logger.info(f"Streaming summaries for job {job_id} as {stream_format} after {cursor}")
+    if stream_format == 'sse':
+        body, mimetype = generate_sse(), 'text/event-stream'
+    else:
+        body, mimetype = generate_ndjson(), 'application/x-ndjson'
+    response = Response(stream_with_context(body), mimetype=mimetype,
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Runs when the server closes the response, including on client disconnect.
+    response.call_on_close(stream_slots.release)
+    return response
+
 @app.route('/get_benchmark', methods=['GET'])
 def get_benchmark():
     try:
-        # Fetch all benchmark data from Redis
-        benchmark_data = redis_client.hgetall(benchmark_key)
-        
-        if not benchmark_data:
+        # Histograms have a fixed number of buckets and throughput one hash per
+        # minute, so this reads the same small amount of data however many jobs ran.
+        histograms = read_histograms(redis_client)
+        throughput = read_throughput(redis_client)
+        cache_data = redis_client.hgetall(CACHE_STATS_KEY)
+
+        if not histograms and not cache_data:
             return jsonify({"message": "No benchmark data available"}), 404
 
-        # Convert byte strings to regular strings and floats
-        results = {
-            job_id.decode('utf-8'): float(processing_time)
-            for job_id, processing_time in benchmark_data.items()
+        hits = int(cache_data.get(b'hits', 0))
+        misses = int(cache_data.get(b'misses', 0))
+        cache_stats = {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "near_duplicate_hits": int(cache_data.get(b'near_duplicate_hits', 0)),
+            "llm_calls_avoided": int(cache_data.get(b'llm_calls_avoided', 0))
         }
 
-        # Calculate some statistics
-        times = list(results.values())
+        jobs = histograms.pop('job', {"count": 0})
         stats = {
-            "total_jobs": len(times),
-            "average_time": sum(times) / len(times),
-            "min_time": min(times),
-            "max_time": max(times)
+            "total_jobs": jobs["count"],
+            "average_time": jobs.get("mean", 0.0),
+            "min_time": jobs.get("min", 0.0),
+            "max_time": jobs.get("max", 0.0),
+            "p50_time": jobs.get("p50", 0.0),
+            "p90_time": jobs.get("p90", 0.0),
+            "p99_time": jobs.get("p99", 0.0)
         }
 
+        # Histogram names are "<kind>:<name>": stage:fetch, s3:get, llm:<model>, llm_ttft:<model>.
+        latency = {}
+        for name, summary in histograms.items():
+            kind, _, label = name.partition(':')
+            latency.setdefault(kind, {})[label] = summary
+
         return jsonify({
-            "benchmark_results": results,
-            "statistics": stats
+            "statistics": stats,
+            "latency": latency,
+            "throughput": throughput,
+            "cache": cache_stats
         })
 
     except Exception as e:
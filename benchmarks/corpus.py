@@ -0,0 +1,57 @@
+import random
+
+# Sentences in the register of Yargıtay decisions, recombined to build documents.
+_HEADERS = (
+    "T.C. YARGITAY {daire}. HUKUK DAİRESİ\nEsas No: {year}/{esas}\nKarar No: {year}/{karar}\n",
+    "YARGITAY {daire}. CEZA DAİRESİ\nE. {year}/{esas} K. {year}/{karar}\n",
+)
+_SENTENCES = (
+    "Taraflar arasındaki alacak davasının yapılan yargılaması sonunda ilamda yazılı nedenlerden dolayı "
+    "davanın kısmen kabulüne dair verilen hükmün süresi içinde davalı vekili tarafından temyiz edilmesi üzerine "
+    "dosya incelendi, gereği düşünüldü.",
+    "Davacı vekili, müvekkilinin davalı işyerinde uzun yıllar çalıştığını, iş sözleşmesinin haklı bir neden "
+    "olmaksızın feshedildiğini ileri sürerek kıdem ve ihbar tazminatlarının faiziyle birlikte tahsilini talep etmiştir.",
+    "Davalı vekili, davacının devamsızlık yaptığını, feshin 4857 sayılı İş Kanunu'nun 25. maddesi uyarınca "
+    "haklı nedene dayandığını savunarak davanın reddini istemiştir.",
+    "Mahkemece, toplanan deliller ve bilirkişi raporuna göre feshin haklı nedene dayanmadığı gerekçesiyle "
+    "davanın kısmen kabulüne karar verilmiştir.",
+    "Dosyadaki yazılara, toplanan delillerle kararın dayandığı gerektirici sebeplere göre davalının aşağıdaki "
+    "bendin kapsamı dışında kalan temyiz itirazları yerinde değildir.",
+    "Hükme esas alınan bilirkişi raporunda fazla mesai alacağının hesaplanmasında tanık beyanlarının "
+    "değerlendirilmesi usul ve yasaya uygun değildir.",
+    "6100 sayılı Hukuk Muhakemeleri Kanunu'nun 266. maddesi uyarınca çözümü özel veya teknik bilgiyi gerektiren "
+    "hallerde bilirkişinin oy ve görüşünün alınmasına karar verilir.",
+    "Yargıtay Hukuk Genel Kurulu'nun yerleşik içtihatlarında da vurgulandığı üzere ispat yükü kural olarak "
+    "iddia eden tarafa aittir.",
+    "Açıklanan nedenlerle temyiz olunan kararın yukarıda gösterilen sebeplerden dolayı bozulmasına, peşin alınan "
+    "temyiz harcının istek halinde ilgiliye iadesine oybirliğiyle karar verildi.",
+)
+# Decision sizes in characters are roughly log-normal: most are a few kilobytes,
+# a long tail runs to several tens of kilobytes and gets chunked.
+_SIZE_MU = 8.8
+_SIZE_SIGMA = 0.8
+_MAX_SIZE = 120_000
+
+
+def synthetic_decision(rng):
+    header = rng.choice(_HEADERS).format(daire=rng.randint(1, 23), year=rng.randint(2010, 2024),
+                                         esas=rng.randint(1, 20000), karar=rng.randint(1, 20000))
+    target = min(int(rng.lognormvariate(_SIZE_MU, _SIZE_SIGMA)), _MAX_SIZE)
+    paragraphs = [header]
+    size = len(header)
+    while size < target:
+        paragraph = ' '.join(rng.choice(_SENTENCES) for _ in range(rng.randint(2, 5)))
+        paragraphs.append(paragraph)
+        size += len(paragraph) + 2
+    return '\n\n'.join(paragraphs)
+
+
+def seed_bucket(s3, bucket, prefix, count, seed=0):
+    """Put `count` synthetic decisions under `prefix`; returns their total size in bytes."""
+    rng = random.Random(seed)
+    total = 0
+    for i in range(count):
+        body = synthetic_decision(rng).encode('utf-8')
+        s3.put(bucket, f"{prefix}{i:06d}.txt", body)
+        total += len(body)
+    return total
@@ -0,0 +1,95 @@
+import asyncio
+import json
+import random
+from aiohttp import web
+
+# A well-formed answer in the format the prompt asks for, followed by the kind of
+# trailing chatter real models add, so streaming early stop has something to cut.
+SUMMARY_TEXT = (
+    '{"Dava Konusu": "Davacı işçinin iş sözleşmesinin haksız feshi nedeniyle kıdem ve ihbar tazminatı talebi.", '
+    '"Hukuki Dayanak": "4857 sayılı İş Kanunu\'nun 17. ve 25. maddeleri ile 1475 sayılı Kanun\'un 14. maddesi.", '
+    '"Mahkeme Kararı": "Davanın kısmen kabulüne, kıdem tazminatının davalıdan tahsiline karar verilmiştir.", '
+    '"Kararın Gerekçesi": "Feshin haklı nedene dayandığı ispatlanamadığından davacı tazminata hak kazanmıştır."}'
+    '\n\nEk açıklama: ' + 'Bu özet karar metnindeki bilgilere dayanmaktadır. ' * 20
+)
+
+
+class FakeLLM:
+    """Stand-in for the Together `/inference` endpoint.
+
+    Answers both plain and streaming (SSE) requests after `latency` seconds
+    (plus up to `jitter` more), emitting `tokens_per_second` tokens of about
+    four characters each. A fraction `error_rate` of requests fails with 503,
+    and `rate_limit_rate` with 429 and a Retry-After header.
+    """
+
+    def __init__(self, latency=0.5, jitter=0.2, tokens_per_second=200, error_rate=0.0, rate_limit_rate=0.0,
+                 retry_after=1, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.stats = {"calls": 0, "ok": 0, "errors": 0, "throttled": 0, "aborted": 0, "tokens_sent": 0}
+        self._runner = None
+        self.api_url = None
+
+    async def start(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post('/inference', self._inference)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.api_url = f'http://127.0.0.1:{port}/inference'
+        return self
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    def reset(self):
+        self.stats = dict.fromkeys(self.stats, 0)
+
+    async def _inference(self, request):
+        payload = await request.json()
+        self.stats["calls"] += 1
+        roll = self.random.random()
+        if roll < self.rate_limit_rate:
+            self.stats["throttled"] += 1
+            return web.json_response({"error": "rate limited"}, status=429,
+                                     headers={'Retry-After': str(self.retry_after)})
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.stats["errors"] += 1
+            return web.json_response({"error": "upstream unavailable"}, status=503)
+
+        await asyncio.sleep(self.latency + self.random.random() * self.jitter)
+        tokens = [SUMMARY_TEXT[i:i + 4] for i in range(0, len(SUMMARY_TEXT), 4)]
+        if not payload.get('stream'):
+            await asyncio.sleep(len(tokens) / self.tokens_per_second)
+            self.stats["ok"] += 1
+            self.stats["tokens_sent"] += len(tokens)
+            return web.json_response({"output": {"choices": [{"text": SUMMARY_TEXT}]}})
+
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        # Tokens go out in small bursts, as a real server flushes them.
+        burst = max(1, self.tokens_per_second // 50)
+        try:
+            for i in range(0, len(tokens), burst):
+                for token in tokens[i:i + burst]:
+                    await response.write(b'data: ' + json.dumps({"choices": [{"text": token}]}).encode() + b'\n\n')
+                    self.stats["tokens_sent"] += 1
+                await asyncio.sleep(burst / self.tokens_per_second)
+            await response.write(b'data: [DONE]\n\n')
+        except ConnectionResetError:
+            # The client stopped reading once it had all four sections.
+            self.stats["aborted"] += 1
+            return response
+        except asyncio.CancelledError:
+            self.stats["aborted"] += 1
+            raise
+        self.stats["ok"] += 1
+        return response
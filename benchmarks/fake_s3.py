@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import time
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape
+from aiohttp import web
+
+S3_NAMESPACE = 'http://s3.amazonaws.com/doc/2006-03-01/'
+
+
+class FakeS3:
+    """In-memory S3 stand-in covering the calls the summarizer makes.
+
+    Serves path-style ListObjectsV2, GetObject, HeadObject and PutObject on
+    127.0.0.1, with an optional per-request latency. Every GET and PUT is
+    timestamped, so the harness can measure how long each file took from
+    fetch to uploaded summary.
+    """
+
+    def __init__(self, latency=0.0, page_size=1000):
+        self.latency = latency
+        self.page_size = page_size
+        self.buckets = {}
+        self.requests = {"list": 0, "get": 0, "head": 0, "put": 0}
+        self.get_times = {}
+        self.put_times = {}
+        self._runner = None
+        self.endpoint_url = None
+
+    def put(self, bucket, key, body):
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        self.buckets.setdefault(bucket, {})[key] = (body, etag, datetime.now(timezone.utc))
+
+    async def start(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_get('/{bucket}', self._list)
+        app.router.add_get('/{bucket}/{key:.+}', self._get)
+        app.router.add_head('/{bucket}/{key:.+}', self._head)
+        app.router.add_put('/{bucket}/{key:.+}', self._put)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.endpoint_url = f'http://127.0.0.1:{port}'
+        return self
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def _delay(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _not_found(self, code='NoSuchKey'):
+        body = f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{code}</Code><Message>Not found</Message></Error>'
+        return web.Response(status=404, body=body, content_type='application/xml')
+
+    async def _list(self, request):
+        await self._delay()
+        self.requests["list"] += 1
+        objects = self.buckets.get(request.match_info['bucket'])
+        if objects is None:
+            return self._not_found('NoSuchBucket')
+        prefix = request.query.get('prefix', '')
+        after = request.query.get('continuation-token') or request.query.get('start-after', '')
+        max_keys = min(int(request.query.get('max-keys', self.page_size)), self.page_size)
+        keys = sorted(key for key in objects if key.startswith(prefix) and key > after)
+        page, truncated = keys[:max_keys], len(keys) > max_keys
+        contents = ''.join(
+            f'<Contents><Key>{escape(key)}</Key>'
+            f'<LastModified>{objects[key][2].strftime("%Y-%m-%dT%H:%M:%S.000Z")}</LastModified>'
+            f'<ETag>{escape(objects[key][1])}</ETag><Size>{len(objects[key][0])}</Size>'
+            f'<StorageClass>STANDARD</StorageClass></Contents>'
+            for key in page
+        )
+        token = f'<NextContinuationToken>{escape(page[-1])}</NextContinuationToken>' if truncated else ''
+        body = (f'<?xml version="1.0" encoding="UTF-8"?><ListBucketResult xmlns="{S3_NAMESPACE}">'
+                f'<Name>{escape(request.match_info["bucket"])}</Name><Prefix>{escape(prefix)}</Prefix>'
+                f'<KeyCount>{len(page)}</KeyCount><MaxKeys>{max_keys}</MaxKeys>'
+                f'<IsTruncated>{"true" if truncated else "false"}</IsTruncated>{token}{contents}</ListBucketResult>')
+        return web.Response(body=body, content_type='application/xml')
+
+    def _lookup(self, request):
+        return self.buckets.get(request.match_info['bucket'], {}).get(request.match_info['key'])
+
+    async def _get(self, request):
+        await self._delay()
+        self.requests["get"] += 1
+        entry = self._lookup(request)
+        if entry is None:
+            return self._not_found()
+        self.get_times.setdefault((request.match_info['bucket'], request.match_info['key']), time.perf_counter())
+        return web.Response(body=entry[0], headers={'ETag': entry[1]}, content_type='application/octet-stream')
+
+    async def _head(self, request):
+        await self._delay()
+        self.requests["head"] += 1
+        entry = self._lookup(request)
+        if entry is None:
+            return web.Response(status=404)
+        return web.Response(headers={'ETag': entry[1], 'Content-Length': str(len(entry[0]))})
+
+    async def _put(self, request):
+        await self._delay()
+        self.requests["put"] += 1
+        key = request.match_info['key']
+        self.put(request.match_info['bucket'], key, await request.read())
+        self.put_times[(request.match_info['bucket'], key)] = time.perf_counter()
+        return web.Response(headers={'ETag': self.buckets[request.match_info['bucket']][key][1]})
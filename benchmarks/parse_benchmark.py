@@ -0,0 +1,139 @@
+"""Micro-benchmark of the summary parser against the one it replaced.
+
+Parses model answers in the shapes seen in practice (a JSON object, fenced
+JSON, JSON cut short by the streaming early stop, and "name: value" text)
+with both implementations and prints microseconds per answer:
+
+    python -m benchmarks.parse_benchmark --iterations 20000
+
+Text answers must parse to the same dict with both; the script exits
+non-zero if they do not. For JSON answers the old parser split keys on
+the first colon of each line, so only the new output is meaningful there.
+"""
+import argparse
+import logging
+import sys
+import timeit
+from benchmarks.fake_llm import SUMMARY_TEXT
+from summarizer.parsing import parse_summaries, parse_summary
+
+logger = logging.getLogger('parse_benchmark')
+
+ANSWERS = {
+    "json": SUMMARY_TEXT,
+    "fenced_json": "```json\n" + SUMMARY_TEXT.split("\n\n")[0] + "\n```",
+    "early_stop_json": SUMMARY_TEXT.split("\n\n")[0].rsplit(", ", 1)[0] + ",",
+    "text": (
+        "Dava Konusu: Davacı işçinin iş sözleşmesinin haksız feshi nedeniyle kıdem ve ihbar tazminatı talebi.\n"
+        "Hukuki Dayanak: 4857 sayılı İş Kanunu'nun 17. ve 25. maddeleri.\n"
+        "1475 sayılı Kanun'un 14. maddesi.\n\n"
+        "Mahkeme Kararı: Davanın kısmen kabulüne karar verilmiştir.\n"
+        "Mahkeme Kararı: Davanın kısmen kabulüne karar verilmiştir.\n"
+        "Kararın Gerekçesi:\n"
+        "   Feshin haklı nedene dayandığı ispatlanamamıştır.  \n"
+    ),
+    "text_partial": "Giriş notu\nDava Konusu: Alacak talebi.\nMahkeme Kararı: Bilgi bulunamadı.\n",
+}
+
+
+def legacy_clean_summary(summary):
+    if isinstance(summary, dict):
+        cleaned_summary = {}
+        for key, value in summary.items():
+            if isinstance(value, str):
+                sections = value.split('\n')
+                cleaned_sections = []
+                for section in sections:
+                    if section.strip() and (not cleaned_sections or section != cleaned_sections[-1]):
+                        cleaned_sections.append(section)
+                cleaned_summary[key] = '\n'.join(cleaned_sections)
+            else:
+                cleaned_summary[key] = value
+        return cleaned_summary
+    elif isinstance(summary, str):
+        sections = summary.split('\n')
+        cleaned_sections = []
+        for section in sections:
+            if section.strip() and (not cleaned_sections or section != cleaned_sections[-1]):
+                cleaned_sections.append(section)
+        return '\n'.join(cleaned_sections)
+    else:
+        return summary  # Return as-is if it's neither string nor dict
+
+async def legacy_parse_summary(summary):
+    sections = ["Dava Konusu:", "Hukuki Dayanak:", "Mahkeme Kararı:", "Kararın Gerekçesi:"]
+    parsed = {section.strip(':'): "Bilgi bulunamadı." for section in sections}
+    
+    if isinstance(summary, dict):
+        # Handle the case where summary is already a dictionary
+        for key in parsed.keys():
+            if key in summary:
+                parsed[key] = summary[key]
+        parsed['Output'] = summary.get('Output', '')
+    elif isinstance(summary, str):
+        # Parse the string summary
+        current_section = None
+        lines = summary.split('\n')
+        for line in lines:
+            line = line.strip()
+            if any(section in line for section in sections):
+                current_section = line.split(':')[0].strip() + ':'
+                parsed[current_section.strip(':')] = line.split(':', 1)[1].strip()
+            elif current_section and line:
+                parsed[current_section.strip(':')] += " " + line
+        parsed['Output'] = summary
+    else:
+        logger.error(f"Unexpected summary type: {type(summary)}")
+        parsed['Output'] = str(summary)
+
+    # Clean up any remaining "Bilgi bulunamadı." entries if we have actual content
+    for key, value in parsed.items():
+        if value.strip() == "Bilgi bulunamadı." and parsed['Output']:
+            parsed[key] = "Özet metninde bu bölüm için spesifik bilgi bulunamadı."
+
+    # Ensure that the Tam Ozet Metni is properly filled
+    parsed["Tam Ozet Metni"] = "\n".join([f"{section}: {content}" for section, content in parsed.items() if section != "Tam Ozet Metni" and section != "Output"])
+    
+    return parsed
+
+
+def _run(coroutine):
+    # The old parser was a coroutine with no awaits; drive it without an event loop.
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    raise RuntimeError("legacy_parse_summary awaited something")
+
+
+def legacy_parse(answer):
+    return _run(legacy_parse_summary(legacy_clean_summary(answer)))
+
+
+def best_of(function, iterations, repeat=5):
+    """Microseconds per call, from the fastest of `repeat` timing runs."""
+    return min(timeit.repeat(function, number=iterations, repeat=repeat)) / iterations * 1e6
+
+
+def main(iterations):
+    mismatches = [name for name, answer in ANSWERS.items()
+                  if name.startswith("text") and legacy_parse(answer) != parse_summary(answer)]
+    print(f"{'answer':>16} {'legacy us':>10} {'new us':>8} {'speedup':>8}")
+    for name, answer in ANSWERS.items():
+        legacy = best_of(lambda: legacy_parse(answer), iterations)
+        new = best_of(lambda: parse_summary(answer), iterations)
+        print(f"{name:>16} {legacy:>10.2f} {new:>8.2f} {legacy / new:>7.1f}x")
+    batch = list(ANSWERS.values()) * max(1, iterations // len(ANSWERS))
+    seconds = timeit.timeit(lambda: parse_summaries(batch), number=1)
+    print(f"parse_summaries: {len(batch) / seconds:,.0f} answers/s over {len(batch)} answers")
+    for name in mismatches:
+        print(f"MISMATCH on {name}:\n  legacy: {legacy_parse(ANSWERS[name])}\n  new:    {parse_summary(ANSWERS[name])}")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Summary parser micro-benchmark")
+    parser.add_argument('--iterations', type=int, default=10000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(main(args.iterations))
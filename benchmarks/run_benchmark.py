@@ -0,0 +1,214 @@
+"""End-to-end throughput benchmark with local stand-ins for S3, Together and Redis.
+
+Seeds an in-memory S3 server with synthetic Turkish decisions, starts a fake
+`/inference` server, and runs the summarizer against them at each
+concurrency level, either as a library call or through the worker's claim
+loop. Writes the results as JSON for comparing runs:
+
+    python -m benchmarks.run_benchmark --files 500 --concurrency 8,32,64 \\
+        --llm-latency 1.0 --error-rate 0.02 --rate-limit-rate 0.02 --output before.json
+
+Nothing leaves the machine: S3 and the LLM are served on 127.0.0.1 and
+Redis is fakeredis. The queue, submission and metrics code runs Lua scripts,
+which fakeredis only supports with `lupa` installed (fakeredis[lua] in
+requirements.txt).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import uuid
+import fakeredis.aioredis
+import psutil
+from benchmarks.corpus import seed_bucket
+from benchmarks.fake_llm import FakeLLM
+from benchmarks.fake_s3 import FakeS3
+
+# botocore signs every request, so it needs some credentials even for the stand-in.
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+
+from summarizer import core, fair_queue
+from summarizer.llm_client import LLM_TARGET_LATENCY, LLMClient
+from summarizer.rate_limit import AIMDLimiter
+from summarizer.s3_handler import SUMMARY_PREFIX, S3ClientManager
+import worker
+
+logger = logging.getLogger('benchmark')
+
+PREFIX = 'decisions/'
+RSS_SAMPLE_INTERVAL = 0.05
+
+
+class BlockingFakeRedis(fakeredis.aioredis.FakeRedis):
+    """fakeredis returns from BLPOP at once on an empty list; wait out the timeout
+    like Redis does, so idle claim loops do not spin and skew the measurements."""
+
+    async def blpop(self, keys, timeout=0):
+        result = await super().blpop(keys, timeout)
+        if result is None:
+            await asyncio.sleep(timeout)
+        return result
+
+
+async def sample_rss(samples, stop):
+    process = psutil.Process()
+    while not stop.is_set():
+        samples.append(process.memory_info().rss)
+        try:
+            await asyncio.wait_for(stop.wait(), RSS_SAMPLE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run_library(args, level, bucket, s3, llm, redis_client):
+    async with S3ClientManager(endpoint_url=s3.endpoint_url, max_pool_connections=core.s3_pool_size()), \
+            LLMClient(api_url=llm.api_url, rate_limit=args.llm_rate_limit,
+                      limiter=AIMDLimiter(level, 1, level, LLM_TARGET_LATENCY)) as llm_client:
+        result = await core.run_summarize_files_from_s3(bucket, PREFIX, args.files, llm_client=llm_client,
+                                                        redis_client=redis_client,
+                                                        stage_workers={'summarize': level})
+    return {"summarized_files": result["summarized_files"], "llm_calls": result["llm_calls"],
+            "early_stops": result["early_stops"], "failed": args.files - result["summarized_files"]}
+
+
+async def run_worker(args, level, bucket, s3, llm, redis_client):
+    job_id = str(uuid.uuid4())
+    job = {'id': job_id, 'bucket_name': bucket, 'prefix': PREFIX, 'max_files': args.files, 'bypass_cache': False}
+    async with redis_client.pipeline(transaction=True) as pipe:
+        fair_queue.push(pipe, json.dumps(job), job)
+        await pipe.execute()
+
+    # The worker takes its stage sizes from the shared defaults.
+    core.DEFAULT_STAGE_WORKERS['summarize'] = level
+    shutdown = asyncio.Event()
+    inflight = asyncio.Semaphore(worker.WORKER_MAX_INFLIGHT)
+    async with S3ClientManager(endpoint_url=s3.endpoint_url,
+                               max_pool_connections=core.s3_pool_size(jobs=worker.WORKER_CONCURRENCY)), \
+            LLMClient(api_url=llm.api_url, rate_limit=args.llm_rate_limit,
+                      limiter=AIMDLimiter(level, 1, level, LLM_TARGET_LATENCY)) as llm_client:
+        loops = [asyncio.create_task(worker.claim_loop(redis_client, llm_client, shutdown, inflight))
+                 for _ in range(worker.WORKER_CONCURRENCY)]
+        while True:
+            status = await redis_client.hget(worker.job_status_key, job_id)
+            if status is not None and json.loads(status).get('status') == 'completed':
+                break
+            if status is not None and 'error' in json.loads(status):
+                raise RuntimeError(f"Benchmark job failed: {json.loads(status)['error']}")
+            await asyncio.sleep(0.05)
+        shutdown.set()
+        await asyncio.gather(*loops)
+    status = json.loads(status)
+    return {"summarized_files": status["summarized_files"], "llm_calls": None, "early_stops": None,
+            "failed": args.files - status["summarized_files"]}
+
+
+async def run_level(args, level, s3, llm):
+    bucket = f"bench-{args.mode}-{level}"
+    seed_bucket(s3, bucket, PREFIX, args.files, args.seed)
+    redis_client = BlockingFakeRedis()
+    llm.reset()
+
+    rss_samples, stop = [], asyncio.Event()
+    sampler = asyncio.create_task(sample_rss(rss_samples, stop))
+    started = time.perf_counter()
+    runner = run_library if args.mode == 'library' else run_worker
+    result = await runner(args, level, bucket, s3, llm, redis_client)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await sampler
+
+    # Per-file latency: from the source GET to the summary PUT, as seen by the S3 stand-in.
+    latencies = [s3.put_times[(bucket, f"{SUMMARY_PREFIX}{key}")] - s3.get_times[(bucket, key)]
+                 for key in s3.buckets[bucket]
+                 if key.startswith(PREFIX) and (bucket, f"{SUMMARY_PREFIX}{key}") in s3.put_times]
+    llm_calls = result["llm_calls"] if result["llm_calls"] is not None else llm.stats["calls"]
+    return {
+        "concurrency": level,
+        "files": args.files,
+        "summarized_files": result["summarized_files"],
+        "failed_files": result["failed"],
+        "elapsed_s": elapsed,
+        "files_per_s": result["summarized_files"] / elapsed if elapsed else 0.0,
+        "latency_p50_s": percentile(latencies, 0.5),
+        "latency_p99_s": percentile(latencies, 0.99),
+        "peak_rss_mb": max(rss_samples) / 2 ** 20,
+        "rss_growth_mb": (max(rss_samples) - rss_samples[0]) / 2 ** 20,
+        "llm_calls": llm_calls,
+        "llm_calls_per_file": llm_calls / result["summarized_files"] if result["summarized_files"] else None,
+        "llm_requests": dict(llm.stats),
+        "early_stops": result["early_stops"],
+    }
+
+
+async def main(args):
+    s3 = await FakeS3(latency=args.s3_latency).start()
+    llm = await FakeLLM(latency=args.llm_latency, jitter=args.llm_jitter, tokens_per_second=args.tokens_per_second,
+                        error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, seed=args.seed).start()
+    results = []
+    try:
+        for level in args.concurrency:
+            logger.warning(f"Running {args.files} files at concurrency {level} ({args.mode})")
+            result = await run_level(args, level, s3, llm)
+            results.append(result)
+            logger.warning(f"  {result['files_per_s']:.2f} files/s, p99 {result['latency_p99_s'] or 0:.2f}s, "
+                           f"peak RSS {result['peak_rss_mb']:.0f} MB, "
+                           f"{result['llm_calls_per_file'] or 0:.2f} LLM calls/file")
+    finally:
+        await llm.stop()
+        await s3.stop()
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline end-to-end summarizer benchmark")
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--concurrency', default='8,32', help="comma-separated summarize-stage worker counts")
+    parser.add_argument('--mode', choices=('library', 'worker'), default='library',
+                        help="call run_summarize_files_from_s3 directly, or go through the worker's claim loop")
+    parser.add_argument('--llm-latency', type=float, default=0.5, help="seconds before the first token")
+    parser.add_argument('--llm-jitter', type=float, default=0.2)
+    parser.add_argument('--tokens-per-second', type=int, default=200)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of LLM requests failing with 503")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="fraction of LLM requests getting 429")
+    parser.add_argument('--llm-rate-limit', type=float, default=1000.0, help="client-side requests/s quota")
+    parser.add_argument('--s3-latency', type=float, default=0.005)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+    args.concurrency = [int(level) for level in args.concurrency.split(',')]
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', force=True)
+    results = asyncio.run(main(args))
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key not in ('output', 'verbose')},
+        "environment": {"python": sys.version.split()[0], "platform": platform.platform(),
+                        "cpu_count": os.cpu_count(), "llm_stream": core.LLM_STREAM},
+        "timestamp": time.time(),
+        "results": results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"{'concurrency':>11} {'files/s':>8} {'p50 s':>7} {'p99 s':>7} {'RSS MB':>7} {'calls/file':>10}")
+    for result in results:
+        print(f"{result['concurrency']:>11} {result['files_per_s']:>8.2f} {result['latency_p50_s'] or 0:>7.2f} "
+              f"{result['latency_p99_s'] or 0:>7.2f} {result['peak_rss_mb']:>7.0f} "
+              f"{result['llm_calls_per_file'] or 0:>10.2f}")
+    print(f"Results written to {args.output}")
@@ -0,0 +1,101 @@
+"""Cold-start benchmark: import time and memory of the web and worker entry points.
+
+Imports each module in a fresh interpreter several times, as a new dyno or
+gunicorn worker would, and reports the median import time, the peak RSS
+after importing and which heavy dependencies came along:
+
+    python -m benchmarks.startup_benchmark --runs 5 --output startup.json
+
+With --importtime, also lists the slowest imports of each module from
+`python -X importtime`.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+MODULES = ('app', 'worker')
+# Dependencies only the worker needs; the web process should not load them.
+HEAVY_MODULES = ('aiohttp', 'aiobotocore', 'botocore', 'tenacity', 'numpy', 'pyarrow', 'certifi', 'rq')
+
+_PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{
+    "import_s": elapsed,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "modules": len(sys.modules),
+    "heavy": [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+
+def _env():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')]))}
+
+
+def probe(module):
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                            capture_output=True, text=True, check=True, env=_env()).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process_s"] = time.perf_counter() - started
+    return result
+
+
+def slowest_imports(module, limit=10):
+    """The `limit` imports with the largest cumulative time, in seconds."""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, check=True, env=_env()).stderr
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len('import time:'):].split('|'))
+        imports.append((int(cumulative) / 1e6, name))
+    return sorted(imports, reverse=True)[:limit]
+
+
+def run(module, runs):
+    results = [probe(module) for _ in range(runs)]
+    return {
+        "module": module,
+        "runs": runs,
+        "import_s_median": statistics.median(result["import_s"] for result in results),
+        "process_s_median": statistics.median(result["process_s"] for result in results),
+        "max_rss_mb_median": statistics.median(result["max_rss_mb"] for result in results),
+        "modules": results[-1]["modules"],
+        "heavy_modules": results[-1]["heavy"],
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Import time and memory of the web and worker processes")
+    parser.add_argument('modules', nargs='*', default=list(MODULES))
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--importtime', action='store_true', help="list the slowest imports of each module")
+    parser.add_argument('--output', help="also write the results as JSON to this file")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    results = [run(module, args.runs) for module in args.modules]
+    print(f"{'module':>8} {'import ms':>10} {'process ms':>11} {'RSS MB':>7} {'modules':>8}  heavy dependencies")
+    for result in results:
+        print(f"{result['module']:>8} {result['import_s_median'] * 1000:>10.0f} "
+              f"{result['process_s_median'] * 1000:>11.0f} {result['max_rss_mb_median']:>7.1f} "
+              f"{result['modules']:>8}  {', '.join(result['heavy_modules']) or '-'}")
+        if args.importtime:
+            for seconds, name in slowest_imports(result['module']):
+                print(f"{'':>8} {seconds * 1000:>10.1f}  {name}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"python": sys.version.split()[0], "timestamp": time.time(), "results": results}, f, indent=2)
+        print(f"Results written to {args.output}")
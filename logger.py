@@ -1,24 +1,171 @@
+import atexit
+import contextvars
+import json
 import logging
+import os
+import queue
 import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# 'json' writes one JSON object per line for log drains; 'text' the classic format.
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+# Per-file records (those logged with a file_key) are rate limited per message:
+# at most LOG_SAMPLE_LIMIT of each every LOG_SAMPLE_INTERVAL seconds. Warnings
+# and errors always pass.
+LOG_SAMPLE_LIMIT = int(os.getenv('LOG_SAMPLE_LIMIT', 20))
+LOG_SAMPLE_INTERVAL = float(os.getenv('LOG_SAMPLE_INTERVAL', 10))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# Record attributes copied into structured output when set, from `extra=` or log_context.
+CONTEXT_FIELDS = ('job_id', 'shard_id', 'file_key', 'suppressed')
+
+_context = contextvars.ContextVar('log_context', default={})
+_listener = None
+_handler = None
+_lock = threading.Lock()
+
+
+@contextmanager
+def log_context(**fields):
+    """Attach `fields` (e.g. job_id) to every record logged inside the block,
+    including from tasks it starts."""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        for field, value in _context.get().items():
+            if not hasattr(record, field):
+                setattr(record, field, value)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Rate-limits per-file records below WARNING, per message template.
+
+    Messages use %-style arguments, so every record from one call site shares
+    `record.msg` and is counted together. The first record let through after
+    a window with drops carries how many were dropped as `suppressed`.
+    """
+
+    def __init__(self, limit=None, interval=None):
+        super().__init__()
+        self.limit = limit or LOG_SAMPLE_LIMIT
+        self.interval = interval or LOG_SAMPLE_INTERVAL
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or getattr(record, 'file_key', None) is None:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            started, count, dropped = self._windows.get(key, (now, 0, 0))
+            if now - started >= self.interval:
+                started, count = now, 0
+            if count >= self.limit:
+                self._windows[key] = (started, count, dropped + 1)
+                return False
+            self._windows[key] = (started, count + 1, 0)
+        if dropped:
+            record.suppressed = dropped
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        text = super().format(record)
+        context = ' '.join(f"{field}={getattr(record, field)}" for field in CONTEXT_FIELDS
+                           if getattr(record, field, None) is not None)
+        return f"{text} [{context}]" if context else text
+
+
+class _BackgroundHandler(QueueHandler):
+    def prepare(self, record):
+        # Records never leave the process, so they need not be made picklable;
+        # leaving them unformatted moves the %-formatting to the listener thread.
+        return record
+
+
+def _start_listener():
+    global _listener
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else TextFormatter(TEXT_FORMAT))
+    _handler.queue = queue.SimpleQueue()
+    _listener = QueueListener(_handler.queue, stream)
+    _listener.start()
+
+
+def stop_logging():
+    """Write out every queued record and stop the writer thread.
+
+    Runs at exit, but processes that leave through os._exit, such as
+    multiprocessing children, must call it themselves.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def configure_logging(level=None):
+    """Route the root logger through a queue to a background writer thread.
+
+    Safe to call more than once; only the first call configures anything.
+    The calling thread only filters and enqueues records, so a slow stdout
+    never blocks the event loop. Forked children (worker processes,
+    gunicorn --preload workers) start their own writer thread.
+    """
+    global _handler
+    with _lock:
+        if _handler is not None:
+            return
+        _handler = _BackgroundHandler(queue.SimpleQueue())
+        _handler.addFilter(ContextFilter())
+        _handler.addFilter(SamplingFilter())
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(_handler)
+        root.setLevel(level or LOG_LEVEL)
+        _start_listener()
+        atexit.register(stop_logging)
+        os.register_at_fork(after_in_child=_start_listener)
+
 
 def setup_logger(name):
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)
-    
-    # Create console handler and set level to debug
-    ch = logging.StreamHandler(sys.stdout)
-    ch.setLevel(logging.DEBUG)
-    
-    # Create formatter
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    
-    # Add formatter to ch
-    ch.setFormatter(formatter)
-    
-    # Add ch to logger
-    logger.addHandler(ch)
-    
-    return logger
+    configure_logging()
+    return logging.getLogger(name)
 
 # Make sure to export the setup_logger function
-__all__ = ['setup_logger']
\ No newline at end of file
+__all__ = ['setup_logger', 'configure_logging', 'log_context', 'stop_logging']
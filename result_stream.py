@@ -0,0 +1,153 @@
+import json
+import logging
+import threading
+import redis
+from summarizer.progress import results_key
+
+logger = logging.getLogger(__name__)
+
+# How long the shared XREAD blocks; also the longest a new follower waits to be included.
+HUB_BLOCK_MS = 1000
+# Followers wake up at least this often, so they can send keepalives.
+FOLLOW_TIMEOUT = 15
+FOLLOW_BATCH_SIZE = 100
+# Written by the worker; a job whose status is final has no more results coming.
+JOB_STATUS_KEY = 'job_status'
+
+
+def _stream_id(entry_id):
+    entry_id = entry_id.decode('utf-8') if isinstance(entry_id, bytes) else entry_id
+    ms, _, seq = entry_id.partition('-')
+    return int(ms), int(seq or 0)
+
+
+def _final_status(status):
+    if status is None:
+        return None
+    status = json.loads(status)
+    if status.get('status') == 'completed' or 'error' in status:
+        return status
+    return None
+
+
+class ResultStreamHub:
+    """Wakes up followers of job result streams with one Redis connection per process.
+
+    Each follower reads its own entries with XRANGE and, once caught up,
+    waits here. A single background thread blocks on XREAD across every
+    job that currently has followers, checks their statuses with one HMGET,
+    and notifies the followers whose stream grew or whose job finished. So
+    thousands of open streams cost one blocking Redis call per gunicorn
+    process instead of one per client.
+    """
+
+    def __init__(self, redis_url):
+        self.redis_url = redis_url
+        self._lock = threading.Lock()
+        self._conditions = {}
+        self._waiting = {}
+        self._latest = {}
+        self._positions = {}
+        self._finished = set()
+        self._thread = None
+
+    def _ensure_started(self):
+        # Started lazily so the thread and its connection belong to the forked worker.
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='result-stream-hub', daemon=True)
+            self._thread.start()
+
+    def wait(self, job_id, cursor, timeout=None):
+        """Block until the job has results after `cursor` or has finished.
+
+        Returns False if FOLLOW_TIMEOUT passes first.
+        """
+        cursor = cursor or '0-0'
+        with self._lock:
+            self._ensure_started()
+            condition = self._conditions.setdefault(job_id, threading.Condition(self._lock))
+            self._waiting.setdefault(job_id, []).append(cursor)
+            self._positions.setdefault(job_id, cursor)
+            try:
+                return condition.wait_for(
+                    lambda: job_id in self._finished or self._latest.get(job_id, (0, 0)) > _stream_id(cursor),
+                    timeout or FOLLOW_TIMEOUT)
+            finally:
+                self._waiting[job_id].remove(cursor)
+                if not self._waiting[job_id]:
+                    del self._waiting[job_id]
+                    del self._conditions[job_id]
+                    del self._positions[job_id]
+                    self._latest.pop(job_id, None)
+                    self._finished.discard(job_id)
+
+    def _run(self):
+        client = redis.Redis.from_url(self.redis_url)
+        while True:
+            with self._lock:
+                # A stream is first read from its first follower's cursor, so an entry
+                # added before the stream joined this XREAD is not missed.
+                positions = dict(self._positions)
+            if not positions:
+                threading.Event().wait(HUB_BLOCK_MS / 1000)
+                continue
+            job_ids = {results_key(job_id): job_id for job_id in positions}
+            try:
+                statuses = client.hmget(JOB_STATUS_KEY, list(positions))
+                response = client.xread({key: positions[job_id] for key, job_id in job_ids.items()},
+                                        count=1, block=HUB_BLOCK_MS)
+                grown = [job_ids[key.decode('utf-8')] for key, _ in response or []]
+                # Skip straight to each stream's newest entry; followers read the
+                # entries in between themselves.
+                newest = []
+                if grown:
+                    with client.pipeline(transaction=False) as pipe:
+                        for job_id in grown:
+                            pipe.xrevrange(results_key(job_id), count=1)
+                        newest = pipe.execute()
+            except redis.RedisError as e:
+                logger.error(f"Result stream hub read failed: {str(e)}")
+                threading.Event().wait(HUB_BLOCK_MS / 1000)
+                continue
+            with self._lock:
+                for job_id, status in zip(positions, statuses):
+                    if job_id in self._conditions and _final_status(status) is not None:
+                        self._finished.add(job_id)
+                        self._conditions[job_id].notify_all()
+                for job_id, entries in zip(grown, newest):
+                    if job_id in self._conditions and entries:
+                        entry_id = entries[0][0].decode('utf-8')
+                        self._positions[job_id] = entry_id
+                        self._latest[job_id] = _stream_id(entry_id)
+                        self._conditions[job_id].notify_all()
+
+
+def follow(redis_client, hub, job_id, cursor=None):
+    """Yield a job's results as they arrive, starting after `cursor`.
+
+    Yields ("summary", entry_id, result) for each result, ("keepalive",)
+    whenever FOLLOW_TIMEOUT passes without one, and finally ("end", status)
+    once the job is finished and every result has been sent.
+    """
+    key = results_key(job_id)
+    while True:
+        entries = redis_client.xrange(key, min=f"({cursor}" if cursor else '-', max='+', count=FOLLOW_BATCH_SIZE)
+        for entry_id, fields in entries:
+            cursor = entry_id.decode('utf-8')
+            yield "summary", cursor, {
+                "file_key": fields[b'file_key'].decode('utf-8'),
+                "summary_key": fields[b'summary_key'].decode('utf-8'),
+                "summary": json.loads(fields[b'summary'])
+            }
+        if len(entries) == FOLLOW_BATCH_SIZE:
+            continue
+        # Results are flushed before the status is set, so once the job is
+        # finished one more read is guaranteed to see everything.
+        status = _final_status(redis_client.hget(JOB_STATUS_KEY, job_id))
+        if status is not None:
+            if not redis_client.xrange(key, min=f"({cursor}" if cursor else '-', max='+', count=1):
+                yield "end", status
+                return
+            continue
+        if not hub.wait(job_id, cursor):
+            yield "keepalive",
@@ -0,0 +1,70 @@
+import argparse
+import json
+import os
+import redis
+from dotenv import load_dotenv
+from logger import setup_logger
+from summarizer.submission import build_job, submit_jobs
+
+load_dotenv()
+
+logger = setup_logger(__name__)
+
+redis_url = os.getenv('REDIS_URL', 'redis://localhost:6379')
+# Prefixes re-processed on every scheduled run, keyed by "bucket:prefix".
+schedule_key = 'incremental_schedule'
+# Upper bound on new or changed files summarized per prefix and run.
+SCHEDULE_MAX_FILES = int(os.getenv('SCHEDULE_MAX_FILES', 10000))
+
+
+def register(redis_client, bucket_name, prefix, max_files):
+    entry = {'bucket_name': bucket_name, 'prefix': prefix, 'max_files': max_files}
+    redis_client.hset(schedule_key, f"{bucket_name}:{prefix}", json.dumps(entry))
+    logger.info(f"Scheduled incremental runs for {bucket_name}/{prefix}")
+
+
+def unregister(redis_client, bucket_name, prefix):
+    redis_client.hdel(schedule_key, f"{bucket_name}:{prefix}")
+    logger.info(f"Removed {bucket_name}/{prefix} from the schedule")
+
+
+def enqueue_scheduled(redis_client):
+    """Enqueue one incremental job per registered prefix; returns the job ids.
+
+    A prefix whose previous scheduled run is still queued or running keeps
+    that job rather than getting a second one.
+    """
+    jobs = []
+    for entry in redis_client.hvals(schedule_key):
+        entry = json.loads(entry)
+        jobs.append(build_job({**entry, 'incremental': True}))
+    if not jobs:
+        return []
+    job_ids = []
+    for job, (job_id, status) in zip(jobs, submit_jobs(redis_client, jobs)):
+        logger.info(f"Job {status}: {job_id} ({job['bucket_name']}/{job['prefix']})")
+        job_ids.append(job_id)
+    return job_ids
+
+
+if __name__ == '__main__':
+    # Run with no arguments from Heroku Scheduler (e.g. daily) to enqueue every
+    # registered prefix; use "add" and "remove" to manage the list.
+    parser = argparse.ArgumentParser(description="Incremental summarization schedule")
+    subparsers = parser.add_subparsers(dest='command')
+    add_parser = subparsers.add_parser('add')
+    add_parser.add_argument('bucket_name')
+    add_parser.add_argument('prefix', nargs='?', default='')
+    add_parser.add_argument('--max-files', type=int, default=SCHEDULE_MAX_FILES)
+    remove_parser = subparsers.add_parser('remove')
+    remove_parser.add_argument('bucket_name')
+    remove_parser.add_argument('prefix', nargs='?', default='')
+    args = parser.parse_args()
+
+    redis_client = redis.Redis.from_url(redis_url)
+    if args.command == 'add':
+        register(redis_client, args.bucket_name, args.prefix, args.max_files)
+    elif args.command == 'remove':
+        unregister(redis_client, args.bucket_name, args.prefix)
+    else:
+        logger.info(f"Enqueued {len(enqueue_scheduled(redis_client))} incremental jobs")
@@ -1,3 +1,10 @@
-from .core import run_summarize_files_from_s3
-
 __all__ = ['run_summarize_files_from_s3']
+
+
+def __getattr__(name):
+    # summarizer.core pulls in aiohttp, aiobotocore, tenacity and numpy. Import it
+    # on first use, so the web process can load the light modules on their own.
+    if name == 'run_summarize_files_from_s3':
+        from .core import run_summarize_files_from_s3
+        return run_summarize_files_from_s3
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,70 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import unicodedata
+import zlib
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY_PREFIX = 'summary_cache'
+CACHE_STATS_KEY = 'summary_cache_stats'
+# Entries expire after this many seconds without a hit; each hit renews the TTL,
+# so rarely used summaries age out first.
+SUMMARY_CACHE_TTL = int(os.getenv('SUMMARY_CACHE_TTL', 30 * 24 * 3600))
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_text(text):
+    """Canonical form of a decision text, so trivially different copies share a key."""
+    return _WHITESPACE.sub(' ', unicodedata.normalize('NFC', text)).strip()
+
+
+def content_key(text, model, prompt_version):
+    digest = hashlib.sha256()
+    for part in (model, prompt_version, normalize_text(text)):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class SummaryCache:
+    """Parsed summaries in Redis, keyed by a hash of (normalized text, model, prompt version).
+
+    Values are zlib-compressed JSON with a sliding TTL. Hits and misses are
+    counted in the `summary_cache_stats` hash, which `/get_benchmark` reports.
+    """
+
+    def __init__(self, redis_client, model, prompt_version, ttl=None):
+        self.redis = redis_client
+        self.model = model
+        self.prompt_version = prompt_version
+        self.ttl = ttl or SUMMARY_CACHE_TTL
+
+    def key_for(self, text):
+        return f"{CACHE_KEY_PREFIX}:{content_key(text, self.model, self.prompt_version)}"
+
+    async def get(self, key, record_stats=True):
+        """Return the cached summary under `key`, or None. Pass record_stats=False
+        for reads that are not lookups of a file's own text, so they do not
+        count as hits or misses."""
+        try:
+            value = await self.redis.getex(key, ex=self.ttl)
+            if record_stats:
+                await self.redis.hincrby(CACHE_STATS_KEY, 'hits' if value is not None else 'misses', 1)
+        except Exception as e:
+            logger.error(f"Error reading summary cache: {str(e)}")
+            return None
+        if value is None:
+            return None
+        return json.loads(zlib.decompress(value).decode('utf-8'))
+
+    async def set(self, key, parsed_summary):
+        value = zlib.compress(json.dumps(parsed_summary, ensure_ascii=False).encode('utf-8'))
+        try:
+            await self.redis.set(key, value, ex=self.ttl)
+        except Exception as e:
+            logger.error(f"Error writing summary cache: {str(e)}")
+
@@ -0,0 +1,79 @@
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_KEY_PREFIX = 'job_checkpoint'
+# Seconds between checkpoint writes while a job runs.
+CHECKPOINT_INTERVAL = float(os.getenv('CHECKPOINT_INTERVAL', 5))
+CHECKPOINT_TTL = 7 * 24 * 3600
+
+
+class ListingCheckpoint:
+    """Resumable listing position for one job or shard, saved in Redis.
+
+    Files finish out of order in the pipeline, so the checkpoint only
+    advances to the last key before which every listed file has finished.
+    A restarted job passes `start_after` to the listing and never sees
+    those files again. `counts` holds the outcomes of the files behind
+    that key.
+    """
+
+    def __init__(self, redis_client, checkpoint_id, interval=None):
+        self.redis = redis_client
+        self.key = f"{CHECKPOINT_KEY_PREFIX}:{checkpoint_id}"
+        self.interval = interval or CHECKPOINT_INTERVAL
+        self.start_after = None
+        self.files_done = 0
+        self.counts = {}
+        self._next_seq = 0
+        self._watermark = 0
+        self._keys = {}
+        self._finished = {}
+        self._last_save = time.monotonic()
+
+    async def load(self):
+        data = await self.redis.hgetall(self.key)
+        if data:
+            data = {k.decode('utf-8'): v.decode('utf-8') for k, v in data.items()}
+            self.start_after = data['start_after']
+            self.files_done = int(data['files_done'])
+            self.counts = json.loads(data['counts'])
+            logger.info(f"Resuming from checkpoint {self.key}: after {self.start_after} ({self.files_done} files done)")
+        return self
+
+    def track(self, key):
+        """Register a newly listed key; returns its sequence number."""
+        seq = self._next_seq
+        self._next_seq += 1
+        self._keys[seq] = key
+        return seq
+
+    async def finish(self, seq, outcome):
+        self._finished[seq] = outcome
+        while self._watermark in self._finished:
+            outcome = self._finished.pop(self._watermark)
+            self.start_after = self._keys.pop(self._watermark)
+            self.counts[outcome] = self.counts.get(outcome, 0) + 1
+            self.files_done += 1
+            self._watermark += 1
+        if time.monotonic() - self._last_save >= self.interval:
+            await self.save()
+
+    async def save(self):
+        self._last_save = time.monotonic()
+        if self.start_after is None:
+            return
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self.key, mapping={
+                "start_after": self.start_after,
+                "files_done": self.files_done,
+                "counts": json.dumps(self.counts),
+            })
+            pipe.expire(self.key, CHECKPOINT_TTL)
+            await pipe.execute()
+
+    async def clear(self):
+        await self.redis.delete(self.key)
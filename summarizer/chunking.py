@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+TOKEN_ENCODING = 'cl100k_base'
+
+# Headings that open a new part of a decision; chunks prefer to start at one.
+SECTION_BOUNDARY = re.compile(
+    r'^(?=\s*(?:GEREĞİ DÜŞÜNÜLDÜ|HÜKÜM|GEREKÇE|SONUÇ|KARAR|İNCELEME|DAVA)\b)',
+    re.MULTILINE,
+)
+PARAGRAPH_BOUNDARY = re.compile(r'\n\s*\n|\n')
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?;:])\s+')
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+                except Exception as e:
+                    # Without the encoding files, fall back to a rough characters-per-token estimate.
+                    logger.warning(f"tiktoken unavailable, estimating token counts: {str(e)}")
+                    _encoding = False
+    return _encoding
+
+
+async def load_encoding():
+    """Load the tokenizer off the event loop. The first load reads, and may
+    download, the encoding files, which would otherwise stall every job."""
+    if _encoding is None:
+        await asyncio.to_thread(_get_encoding)
+
+
+def fits(text, max_tokens):
+    """Whether `text` is at most `max_tokens` tokens, tokenizing only when needed.
+
+    Every BPE token covers at least one UTF-8 byte, and the fallback
+    estimate never exceeds the byte count either, so a text no longer than
+    `max_tokens` bytes always fits. Characters are no such bound: a
+    character the encoding does not know can take several tokens.
+    """
+    return len(text.encode('utf-8')) <= max_tokens or count_tokens(text) <= max_tokens
+
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // 3 + 1
+
+
+def _split(text, pattern):
+    return [piece for piece in pattern.split(text) if piece and piece.strip()]
+
+
+def _hard_split(text, max_tokens):
+    encoding = _get_encoding()
+    if encoding:
+        tokens = encoding.encode(text, disallowed_special=())
+        return [encoding.decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens)]
+    step = max_tokens * 3
+    return [text[i:i + step] for i in range(0, len(text), step)]
+
+
+def _pieces(text, max_tokens):
+    """Break `text` into pieces of at most `max_tokens`, preferring the coarsest boundary."""
+    for pattern in (SECTION_BOUNDARY, PARAGRAPH_BOUNDARY, SENTENCE_BOUNDARY):
+        parts = _split(text, pattern)
+        if len(parts) > 1:
+            pieces = []
+            for part in parts:
+                if count_tokens(part) <= max_tokens:
+                    pieces.append(part)
+                else:
+                    pieces.extend(_pieces(part, max_tokens))
+            return pieces
+    return _hard_split(text, max_tokens)
+
+
+def split_into_chunks(text, max_tokens):
+    """Split `text` into chunks of at most `max_tokens`, cut at section or paragraph ends.
+
+    Adjacent pieces are packed greedily, so a chunk only breaks where the next
+    piece would not fit.
+    """
+    if count_tokens(text) <= max_tokens:
+        return [text]
+
+    chunks = []
+    current, current_tokens = [], 0
+    for piece in _pieces(text, max_tokens):
+        piece_tokens = count_tokens(piece)
+        if current and current_tokens + piece_tokens > max_tokens:
+            chunks.append('\n'.join(current))
+            current, current_tokens = [], 0
+        current.append(piece.strip('\n'))
+        current_tokens += piece_tokens
+    if current:
+        chunks.append('\n'.join(current))
+    return chunks
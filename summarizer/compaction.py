@@ -0,0 +1,62 @@
+import logging
+import re
+from .chunking import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# The cost breakdown printed after the signatures: the heading plus every following
+# line that is a party label, an amount in TL or the total.
+_COST_TABLE = re.compile(
+    r'^[ \t]*YARGILAMA (?:MASRAFLARI|GİDERLERİ)[ \t]*\n'
+    r'(?:[ \t]*(?:DAVACI|DAVALI|.*\d[\d.,]*[ \t]*TL|Toplam.*)?[ \t]*(?:\n|$))*',
+    re.MULTILINE | re.IGNORECASE,
+)
+# Lines of the signature block: a role word followed only by names, sicil
+# numbers, "…" placeholders, further role words or an e-signature note.
+# Removed: "Başkan …", "Üye 12345", "Katip Ayşe KAYA", "Hâkim 123456 ¸e-imzalıdır",
+# "Başkan Üye Üye Üye Üye". Kept, since they are prose: "Üye X'in karşı oy
+# gerekçesi aşağıdadır", "Hakim reddi talebi yerinde görülmedi".
+_SIGNATURE_LINE = re.compile(
+    r'^[ \t]*(?:Başkan|Üye|Katip|Zabıt Katibi|Hakim|Hâkim)'
+    r'(?:[ \t]*(?:…+|\.{2,})|[ \t]+(?:[A-ZÇĞİÖŞÜÂÎÛ][^\W\d_]*\.?|\d+|¸?e-imzalıdır\.?))*'
+    r'[ \t]*$\n?',
+    re.MULTILINE,
+)
+_E_SIGNATURE = re.compile(r'[¸]?\s*e-imzalıdır\.?', re.IGNORECASE)
+_INLINE_SPACE = re.compile(r'[ \t ]+')
+_TRAILING_SPACE = re.compile(r' +\n')
+_BLANK_LINES = re.compile(r'\n\s*\n+')
+
+# Applied in order; each is a precompiled pattern and its replacement.
+COMPACTION_RULES = (
+    (_COST_TABLE, ''),
+    (_SIGNATURE_LINE, ''),
+    (_E_SIGNATURE, ''),
+    (_INLINE_SPACE, ' '),
+    (_TRAILING_SPACE, '\n'),
+    (_BLANK_LINES, '\n'),
+)
+
+
+def compact_text(text):
+    """Strip boilerplate that carries no meaning for the summary.
+
+    Removes the trailing "YARGILAMA MASRAFLARI" table, signature lines and
+    e-signature notes, and collapses runs of spaces, tabs and blank lines.
+    The result is deterministic, so it is also a stable cache key input.
+    """
+    for pattern, replacement in COMPACTION_RULES:
+        text = pattern.sub(replacement, text)
+    return text.strip()
+
+
+def compact_with_stats(text):
+    """Return the compacted text and how many prompt tokens compaction saved."""
+    compacted = compact_text(text)
+    original_tokens = count_tokens(text)
+    compacted_tokens = count_tokens(compacted)
+    return compacted, {
+        "original_tokens": original_tokens,
+        "compacted_tokens": compacted_tokens,
+        "saved_tokens": original_tokens - compacted_tokens,
+    }
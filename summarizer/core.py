@@ -1,186 +1,543 @@
 import logging
 import os
-import aiohttp
 import json
-import ssl
-import certifi
-from tenacity import retry, stop_after_attempt, wait_random_exponential
-from .s3_handler import get_s3_files, get_file_content, check_summary_exists, upload_summary_to_s3
-import traceback
+import re
+import time
+import uuid
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+from .s3_handler import get_s3_files, list_objects, get_file_content, check_summary_exists, upload_summary_to_s3
+from .pipeline import Stage, run_pipeline
+from .llm_client import LLM_STREAM, LLMClient, TransientLLMError
+from .parsing import IncrementalSummaryParser, parse_summary
+from .summary_index import SummaryIndex
+from .cache import SummaryCache
+from .near_duplicates import NEAR_DUPLICATES, NearDuplicateIndex, adapt_summary, case_numbers, minhash
+from .chunking import count_tokens, fits, load_encoding, split_into_chunks
+from .compaction import compact_with_stats
+from .checkpoint import ListingCheckpoint
+from .object_index import ObjectIndex
+from .progress import JobProgress
+from . import metrics
 from dotenv import load_dotenv
 import asyncio
+from contextlib import aclosing
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-# Set your Together AI API key
-API_KEY = os.getenv("TOGETHER_API_KEY")
-API_URL = "https://api.together.xyz/inference"
+MODEL = os.getenv('MODEL', 'togethercomputer/llama-3.1-70b-chat')
+# Bump whenever the prompt or parsing changes, so cached summaries are regenerated.
+PROMPT_VERSION = '4'
 
-# Create SSL context
-ssl_context = ssl.create_default_context(cafile=certifi.where())
+SUMMARY_SCHEMA = {
+    'Dava Konusu':' Davanın ana konusu ve taraflar arasındaki uyuşmazlık net bir şekilde ifade edilmelidir. Örneğin, "Bir iş sözleşmesinin feshi ile ilgili tazminat talebi" veya "Miras paylaşımı sırasında ortaya çıkan mal varlığı uyuşmazlığı" gibi. Bu bölümde davanın hangi hukuki alanla ilgili olduğu ve ne tür bir talebin incelendiği açıklanmalıdır.',
+    'Hukuki Dayanak': '''Mahkemenin kararını dayandırdığı kanun maddeleri, ilgili hukuki düzenlemeler ve daha önceki içtihatlar bu bölümde belirtilmelidir. Örneğin, "6098 sayılı Türk Borçlar Kanunu'nun 123. maddesi" veya "Yargıtay 9. Hukuk Dairesi'nin emsal niteliğindeki kararı" gibi detaylar yer almalıdır.''',
+    'Mahkeme Kararı': 'Mahkemenin vardığı nihai sonuç ve verdiği hüküm burada belirtilir. Örneğin, "Davacının tazminat talebi kısmen kabul edilmiştir" veya "Mahkeme, davalının itirazını reddetmiştir" gibi karar özetlenir.',
+    'Kararın Gerekçesi': 'Mahkemenin verdiği kararı hangi somut ve hukuki gerekçelerle desteklediği burada açıklanır. Örneğin, "Mahkeme, iş sözleşmesinin haklı bir nedenle feshedilmediği kanaatine varmıştır" gibi gerekçelere yer verilmelidir.'
+}
 
-@retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(5))
-async def summarize_text(text):
+# Only the first sentence of each description goes into the prompt; the examples
+# in SUMMARY_SCHEMA cost tokens on every call without changing the output format.
+PROMPT_SCHEMA = json.dumps(
+    {section: re.match(r'\s*(.*?\.)(?:\s|$)', description).group(1) for section, description in SUMMARY_SCHEMA.items()},
+    ensure_ascii=False,
+)
+
+# Where summaries go: 'object' writes one JSON object per file under summaries/,
+# 'parquet' batches them into Parquet parts (see parquet_sink).
+SUMMARY_SINK = os.getenv('SUMMARY_SINK', 'object')
+
+# Longer inputs are split into chunks of this many tokens and summarized map-reduce style.
+CHUNK_TOKEN_LIMIT = int(os.getenv('CHUNK_TOKEN_LIMIT', 6000))
+CHUNK_SUMMARY_MAX_TOKENS = int(os.getenv('CHUNK_SUMMARY_MAX_TOKENS', 600))
+
+# Prompt templates are assembled once here; building a prompt is then a plain
+# concatenation around the document text.
+_ANSWER_RULES = (
+    "Lütfen her bölümü ayrı ayrı doldurun ve bölüm başlıklarını aynen kullanın. "
+    "Önemli hukuki terimleri ve kanun numaralarını mutlaka belirtin. "
+    "Özet kısa ve öz olmalı ve Turkce olarak yazilmali, ancak kritik bilgileri içermelidir. "
+    "Eğer herhangi bir bölüm için bilgi bulunamazsa, o bölümü 'Bilgi bulunamadı' olarak işaretleyin. "
+    "Lütfen cevabınızı sadece bu dört bölümle sınırlı tutun ve ekstra bilgi eklemeyin.\n"
+    "* kullanmayın. Cevaplari tek satirda yazin.\n"
+    "Cevap:"
+)
+_PROMPT_HEAD = (
+    "Aşağıdaki metin bir Yargıtay kararıdır. Bu kararın özetini çıkarın ve kesinlikle aşağıdaki formatta JSON olarak sunun:\n"
+    f"format: {PROMPT_SCHEMA}\n"
+    "Karar metni:\n"
+)
+_PROMPT_TAIL = "\n" + _ANSWER_RULES
+_CHUNK_PROMPT_HEAD = (
+    "Aşağıdaki metin uzun bir Yargıtay kararının {index}/{total}. parçasıdır. "
+    "Bu parçada geçen bilgileri aşağıdaki dört başlık altında not edin:\n"
+    "format: " + PROMPT_SCHEMA.replace('{', '{{').replace('}', '}}') + "\n"
+    "Karar metni (parça {index}/{total}):\n"
+)
+_CHUNK_PROMPT_TAIL = (
+    "\nYalnızca bu parçada yer alan bilgileri yazın; parçada bir başlıkla ilgili bilgi yoksa o başlığı 'Bilgi bulunamadı' olarak işaretleyin. "
+    "Önemli hukuki terimleri, kanun numaralarını ve hüküm fıkralarını mutlaka koruyun. Notlar Turkce olmali.\n"
+    "* kullanmayın. Cevaplari tek satirda yazin.\n"
+    "Cevap:"
+)
+_REDUCE_PROMPT_HEAD = (
+    "Aşağıda uzun bir Yargıtay kararının parçalarından sırayla çıkarılmış notlar yer almaktadır. "
+    "Bu notları birleştirerek kararın tamamının özetini çıkarın ve kesinlikle aşağıdaki formatta JSON olarak sunun:\n"
+    f"format: {PROMPT_SCHEMA}\n"
+    "Notlar:\n"
+)
+_REDUCE_PROMPT_TAIL = (
+    "\nTekrarlanan bilgileri birleştirin, çelişen notlarda kararın sonraki parçalarını (özellikle HÜKÜM kısmını) esas alın.\n"
+    + _ANSWER_RULES
+)
+
+def build_prompt(text):
+    return _PROMPT_HEAD + text + _PROMPT_TAIL
+
+def build_chunk_prompt(chunk, index, total):
+    return _CHUNK_PROMPT_HEAD.format(index=index, total=total) + chunk + _CHUNK_PROMPT_TAIL
+
+def build_reduce_prompt(chunk_summaries):
+    notes = "\n".join(f"Parça {i}: {summary}" for i, summary in enumerate(chunk_summaries, 1))
+    return _REDUCE_PROMPT_HEAD + notes + _REDUCE_PROMPT_TAIL
+
+# Only timeouts, connection errors, 5xx and 429 are retried; the client's limiter
+# already holds new requests back for the duration of any Retry-After.
+@retry(retry=retry_if_exception_type(TransientLLMError), wait=wait_random_exponential(min=1, max=60),
+       stop=stop_after_attempt(5), reraise=True)
+async def _complete(llm, prompt, max_tokens=1500, timings=None):
+    payload = {
+        "model": MODEL,
+        "prompt": prompt,
+        "max_tokens": max_tokens,
+        "temperature": 0.7,
+        "top_p": 0.95,
+        "top_k": 40,
+        "repetition_penalty": 1.1,
+        "stop": ['Human:', '\n\n'],
+        "stream": False
+    }
+    if timings is None:
+        timings = {}
+    if not LLM_STREAM:
+        response_data = await llm.complete(payload)
+        timings['llm_calls'] = timings.get('llm_calls', 0) + 1
+        if 'output' in response_data and 'choices' in response_data['output']:
+            return response_data['output']['choices'][0]['text'].strip()
+        return None
+
+    # Stop reading as soon as all four sections are complete; anything after
+    # that is discarded by parse_summary anyway and only costs time and tokens.
+    parser = IncrementalSummaryParser()
+    call_timings = {}
+    async with aclosing(llm.stream(payload, call_timings)) as tokens:
+        async for token in tokens:
+            if parser.feed(token):
+                break
+    timings['llm_calls'] = timings.get('llm_calls', 0) + 1
+    if 'ttft' in call_timings:
+        timings.setdefault('ttft', call_timings['ttft'])
+    if parser.complete:
+        timings['early_stops'] = timings.get('early_stops', 0) + 1
+    return parser.output.strip() or None
+
+async def _summarize(text, llm, timings):
+    await load_encoding()
+    if fits(text, CHUNK_TOKEN_LIMIT):
+        return await _complete(llm, build_prompt(text), timings=timings)
+
+    chunks = split_into_chunks(text, CHUNK_TOKEN_LIMIT)
+    logger.info("Summarizing long text in %d chunks", len(chunks))
+    # A TaskGroup cancels the other chunk calls as soon as one fails for good,
+    # rather than letting them retry for a result that would be discarded.
+    try:
+        async with asyncio.TaskGroup() as tg:
+            tasks = [tg.create_task(_complete(llm, build_chunk_prompt(chunk, i, len(chunks)),
+                                              CHUNK_SUMMARY_MAX_TOKENS, timings))
+                     for i, chunk in enumerate(chunks, 1)]
+    except ExceptionGroup as group:
+        # Callers expect the LLMError itself, as gather raised it.
+        raise group.exceptions[0]
+    chunk_summaries = [summary for summary in (task.result() for task in tasks) if summary]
+    if not chunk_summaries:
+        return None
+    return await _complete(llm, build_reduce_prompt(chunk_summaries), timings=timings)
+
+def estimate_llm_calls(text):
+    """LLM calls summarizing `text` would take: one, or one per chunk plus the reduce."""
+    if fits(text, CHUNK_TOKEN_LIMIT):
+        return 1
+    tokens = count_tokens(text)
+    return 1 if tokens <= CHUNK_TOKEN_LIMIT else -(-tokens // CHUNK_TOKEN_LIMIT) + 1
+
+async def summarize_text(text, llm=None, timings=None):
+    """Return the model's summary of `text`, or None if the response had no output.
+
+    API failures propagate as LLMError; transient ones have already been
+    retried, so callers never mistake an error message for a summary. When
+    `timings` is a dict, it receives the number of LLM calls made, how many
+    streams were cut short, and the time to first token in seconds.
+    """
     if len(text) < 50:  # Add a check for very short texts
         return "Metin özet için çok kısa"
 
-    try:
-        schema = {
-              'Dava Konusu':' Davanın ana konusu ve taraflar arasındaki uyuşmazlık net bir şekilde ifade edilmelidir. Örneğin, "Bir iş sözleşmesinin feshi ile ilgili tazminat talebi" veya "Miras paylaşımı sırasında ortaya çıkan mal varlığı uyuşmazlığı" gibi. Bu bölümde davanın hangi hukuki alanla ilgili olduğu ve ne tür bir talebin incelendiği açıklanmalıdır.',
-                'Hukuki Dayanak': '''Mahkemenin kararını dayandırdığı kanun maddeleri, ilgili hukuki düzenlemeler ve daha önceki içtihatlar bu bölümde belirtilmelidir. Örneğin, "6098 sayılı Türk Borçlar Kanunu'nun 123. maddesi" veya "Yargıtay 9. Hukuk Dairesi'nin emsal niteliğindeki kararı" gibi detaylar yer almalıdır.''',
-                'Mahkeme Kararı': 'Mahkemenin vardığı nihai sonuç ve verdiği hüküm burada belirtilir. Örneğin, "Davacının tazminat talebi kısmen kabul edilmiştir" veya "Mahkeme, davalının itirazını reddetmiştir" gibi karar özetlenir.',
-                'Kararın Gerekçesi': 'Mahkemenin verdiği kararı hangi somut ve hukuki gerekçelerle desteklediği burada açıklanır. Örneğin, "Mahkeme, iş sözleşmesinin haklı bir nedenle feshedilmediği kanaatine varmıştır" gibi gerekçelere yer verilmelidir.'
-                }
-        prompt = f"""Aşağıdaki metin bir Yargıtay kararıdır. Bu kararın özetini çıkarın ve kesinlikle aşağıdaki formatta JSON olarak sunun:
-                    format: {schema}
-                    Karar metni:
-                    {text} 
-                Eğer metinde bir bölüm için yeterli bilgi yoksa, "Bilgi bulunamadı" şeklinde not düşebilirsiniz.
-                Lütfen her bölümü ayrı ayrı doldurun ve bölüm başlıklarını aynen kullanın. Önemli hukuki terimleri ve kanun numaralarını mutlaka belirtin. Özet kısa ve öz olmalı ve Turkce olarak yazilmali, ancak kritik bilgileri içermelidir. Eğer herhangi bir bölüm için bilgi bulunamazsa, o bölümü 'Bilgi bulunamadı' olarak işaretleyin. Lütfen cevabınızı sadece bu dört bölümle sınırlı tutun ve ekstra bilgi eklemeyin. 
-                * kullanmayın. Cevaplari tek satirda yazin.
-                Cevap:"""
-        
-        payload = {
-            "model": os.getenv('MODEL', 'togethercomputer/llama-3.1-70b-chat'),
-            "prompt": prompt,
-            "max_tokens": 1500,
-            "temperature": 0.7,
-            "top_p": 0.95,
-            "top_k": 40,
-            "repetition_penalty": 1.1,
-            "stop": ['Human:', '\n\n'],
-            "stream": False
-        }
-        
-        headers = {
-            "Authorization": f"Bearer {API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=ssl_context)) as session:
-            async with session.post(API_URL, json=payload, headers=headers) as response:
-                response_data = await response.json()
-                
-                if 'output' in response_data and 'choices' in response_data['output']:
-                    summary = response_data['output']['choices'][0]['text']
-                    logger.info("Summary created successfully.")
-                    return summary.strip()
-                else:
-                    logger.warning("Summary creation failed: No output in response.")
-                    return "Özet oluşturulamadı."
-        
-    except Exception as e:
-        logger.error(f"Error in summarize_text: {str(e)}")
-        logger.error(traceback.format_exc())  # Log the full traceback
-        return f"Özet oluşturulurken bir hata oluştu: {str(e)}"
-
-def clean_summary(summary):
-    if isinstance(summary, dict):
-        cleaned_summary = {}
-        for key, value in summary.items():
-            if isinstance(value, str):
-                sections = value.split('\n')
-                cleaned_sections = []
-                for section in sections:
-                    if section.strip() and (not cleaned_sections or section != cleaned_sections[-1]):
-                        cleaned_sections.append(section)
-                cleaned_summary[key] = '\n'.join(cleaned_sections)
-            else:
-                cleaned_summary[key] = value
-        return cleaned_summary
-    elif isinstance(summary, str):
-        sections = summary.split('\n')
-        cleaned_sections = []
-        for section in sections:
-            if section.strip() and (not cleaned_sections or section != cleaned_sections[-1]):
-                cleaned_sections.append(section)
-        return '\n'.join(cleaned_sections)
-    else:
-        return summary  # Return as-is if it's neither string nor dict
-
-async def parse_summary(summary):
-    sections = ["Dava Konusu:", "Hukuki Dayanak:", "Mahkeme Kararı:", "Kararın Gerekçesi:"]
-    parsed = {section.strip(':'): "Bilgi bulunamadı." for section in sections}
-    
-    if isinstance(summary, dict):
-        # Handle the case where summary is already a dictionary
-        for key in parsed.keys():
-            if key in summary:
-                parsed[key] = summary[key]
-        parsed['Output'] = summary.get('Output', '')
-    elif isinstance(summary, str):
-        # Parse the string summary
-        current_section = None
-        lines = summary.split('\n')
-        for line in lines:
-            line = line.strip()
-            if any(section in line for section in sections):
-                current_section = line.split(':')[0].strip() + ':'
-                parsed[current_section.strip(':')] = line.split(':', 1)[1].strip()
-            elif current_section and line:
-                parsed[current_section.strip(':')] += " " + line
-        parsed['Output'] = summary
+    if timings is None:
+        timings = {}
+    if llm is None:
+        async with LLMClient() as llm:
+            summary = await _summarize(text, llm, timings)
     else:
-        logger.error(f"Unexpected summary type: {type(summary)}")
-        parsed['Output'] = str(summary)
+        summary = await _summarize(text, llm, timings)
+
+    if summary:
+        logger.debug("Summary created successfully.")
+        return summary
+    logger.warning("Summary creation failed: No output in response.")
+    return None
+
+# Worker count per pipeline stage. The LLM client's adaptive limiter decides how many
+# summarize calls are actually in flight, so that stage only needs enough workers.
+DEFAULT_STAGE_WORKERS = {
+    'check': int(os.getenv('CHECK_WORKERS', 1)),
+    'fetch': int(os.getenv('FETCH_WORKERS', 8)),
+    'compact': int(os.getenv('COMPACT_WORKERS', 1)),
+    'summarize': int(os.getenv('SUMMARIZE_WORKERS', 32)),
+    'parse': int(os.getenv('PARSE_WORKERS', 1)),
+    'upload': int(os.getenv('UPLOAD_WORKERS', 4)),
+}
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', 32))
+
+def s3_pool_size(stage_workers=None, jobs=1):
+    """Connections needed so every S3-facing stage worker of `jobs` concurrent
+    jobs, and each job's listing, can hold one at once."""
+    workers = {**DEFAULT_STAGE_WORKERS, **(stage_workers or {})}
+    return (workers['fetch'] + workers['upload'] + 1) * jobs
 
-    # Clean up any remaining "Bilgi bulunamadı." entries if we have actual content
-    for key, value in parsed.items():
-        if value.strip() == "Bilgi bulunamadı." and parsed['Output']:
-            parsed[key] = "Özet metninde bu bölüm için spesifik bilgi bulunamadı."
+async def run_summarize_files_from_s3(bucket_name, prefix, max_files, llm_client=None, **options):
+    """Summarize up to `max_files` objects under `prefix` and upload the results.
 
-    # Ensure that the Tam Ozet Metni is properly filled
-    parsed["Tam Ozet Metni"] = "\n".join([f"{section}: {content}" for section, content in parsed.items() if section != "Tam Ozet Metni" and section != "Output"])
-    
-    return parsed
+    Options:
+        stage_workers: per-stage worker counts overriding DEFAULT_STAGE_WORKERS.
+        queue_size: bound on items waiting between two stages.
+        redis_client: async Redis client for the summary index and cache.
+            Texts that are near-duplicates of one already summarized reuse
+            its summary (see near_duplicates) unless NEAR_DUPLICATES=0.
+        bypass_cache: summarize files again even if a summary already exists
+            or a cached one matches; the fresh results still refresh the cache.
+        stop_event: once set, no new files are started; files already in the
+            pipeline finish and the result has "stopped": True.
+        inflight: semaphore shared between jobs that bounds how many files
+            are in the pipeline at once.
+        start_after, end_key: only process keys in (start_after, end_key],
+            as used by job shards.
+        checkpoint_id: save the listing position under this id while running
+            and resume from it on the next run; needs `redis_client`.
+        incremental: only process objects that are new or whose ETag changed
+            since they were last summarized under this bucket/prefix; needs
+            `redis_client`.
+        job_id: append each summary to the job's results stream and keep its
+            progress counters; needs `redis_client`.
+        sink: 'object' or 'parquet'; defaults to SUMMARY_SINK.
+    """
+    if llm_client is None:
+        async with LLMClient() as llm_client:
+            return await _run_job(bucket_name, prefix, max_files, llm_client, **options)
+    return await _run_job(bucket_name, prefix, max_files, llm_client, **options)
 
-async def run_summarize_files_from_s3(bucket_name, prefix, max_files):
-    summarized_files = 0
+async def _run_job(bucket_name, prefix, max_files, llm_client, stage_workers=None, queue_size=None,
+                   redis_client=None, bypass_cache=False, stop_event=None, inflight=None, start_after=None,
+                   end_key=None, checkpoint_id=None, incremental=False,
+                   job_id=None, sink=None):
+    workers = {**DEFAULT_STAGE_WORKERS, **(stage_workers or {})}
+    counts = {"skipped": 0, "summarized": 0, "cache_hits": 0, "near_duplicates": 0, "llm_calls_avoided": 0,
+              "original_tokens": 0, "saved_tokens": 0, "llm_calls": 0, "early_stops": 0, "ttft_total": 0.0,
+              "ttft_count": 0}
+    stopped = False
+    # Permits of `inflight` held for items that have not reached on_done yet;
+    # whatever is left when the job exits is given back then.
+    permits = 0
     logger.info(f"Starting to process files from bucket: {bucket_name}, prefix: {prefix}")
-    async for file_key in get_s3_files(bucket_name, prefix, max_files):
-        logger.info(f"Processing file: {file_key}")
+    await load_encoding()
+
+    checkpoint = None
+    resumed = {}
+    if redis_client is not None and checkpoint_id is not None:
+        checkpoint = await ListingCheckpoint(redis_client, checkpoint_id).load()
+        resumed = dict(checkpoint.counts)
+        if checkpoint.start_after is not None:
+            start_after = max(start_after or '', checkpoint.start_after)
+            max_files -= checkpoint.files_done
+    object_index = None
+    if redis_client is not None and incremental:
+        object_index = ObjectIndex(redis_client, bucket_name, prefix)
+    progress = None
+    if redis_client is not None and job_id is not None:
+        progress = await JobProgress(redis_client, job_id).start()
+    summary_index = await SummaryIndex(bucket_name, prefix, redis_client).load()
+    cache = SummaryCache(redis_client, MODEL, PROMPT_VERSION) if redis_client is not None else None
+    near_duplicates = None
+    if redis_client is not None and NEAR_DUPLICATES:
+        near_duplicates = NearDuplicateIndex(redis_client, MODEL, PROMPT_VERSION)
+
+    def summary_key_for(file_key):
+        return f"{prefix}{os.path.basename(file_key)}"
+
+    async def already_summarized(entries):
+        if bypass_cache:
+            return [False] * len(entries)
+        return await summary_index.contains([summary_key_for(entry['Key']) for entry in entries])
+
+    async def list_changed_objects():
+        count = 0
+        objects = list_objects(bucket_name, prefix, start_after, end_key)
+        # Objects summarized before they were indexed are recorded as they are
+        # listed and do not count against max_files.
+        changed_objects = object_index.changed(objects, already_summarized)
+        async with aclosing(objects), aclosing(changed_objects):
+            async for entry, changed in changed_objects:
+                yield entry['Key'], {"object": entry, "changed": changed}
+                count += 1
+                if count >= max_files:
+                    return
+
+    async def list_all_files():
+        async with aclosing(get_s3_files(bucket_name, prefix, max_files, start_after, end_key)) as file_keys:
+            async for file_key in file_keys:
+                yield file_key, {}
+
+    async def list_files():
+        nonlocal stopped, permits
+        if max_files <= 0:
+            return
+        listing = list_changed_objects() if object_index is not None else list_all_files()
+        listed = 0
+        async with aclosing(listing) as file_keys:
+            async for file_key, extra in file_keys:
+                if inflight is not None:
+                    await inflight.acquire()
+                    permits += 1
+                if stop_event is not None and stop_event.is_set():
+                    if inflight is not None:
+                        inflight.release()
+                        permits -= 1
+                    stopped = True
+                    logger.info(f"Stop requested; not starting more files from {bucket_name}/{prefix}")
+                    return
+                item = {"file_key": file_key, "summary_key": summary_key_for(file_key), **extra}
+                if checkpoint is not None:
+                    item["seq"] = checkpoint.track(file_key)
+                if progress is not None:
+                    await progress.listed()
+                listed += 1
+                yield item
+        if progress is not None and listed < max_files:
+            await progress.reduce_total(max_files - listed)
+
+    async def on_done(item, ok):
+        nonlocal permits
+        if inflight is not None:
+            inflight.release()
+            permits -= 1
+        if item.get("outcome") == "pending":
+            # Buffered in the Parquet sink; finished once its part is committed.
+            return
+        if checkpoint is not None:
+            await checkpoint.finish(item["seq"], item.get("outcome", "done" if ok else "failed"))
+        if progress is not None:
+            await progress.finished(item.get("outcome", "failed"))
+
+    async def check(item):
+        # A changed object's existing summary is stale, so it never counts as done.
+        if not bypass_cache and not item.get("changed") and await summary_index.has(item["summary_key"]):
+            logger.info("Valid summary already exists for %s. Skipping.", item['file_key'],
+                        extra={'file_key': item['file_key']})
+            counts["skipped"] += 1
+            item["outcome"] = "skipped"
+            if object_index is not None:
+                await object_index.record(item["object"])
+            return None
+        return item
+
+    async def fetch(item):
+        content = await get_file_content(bucket_name, item["file_key"])
+        if content is None:
+            return None
+        logger.debug("File content retrieved for: %s", item['file_key'], extra={'file_key': item['file_key']})
+        item["text"] = content.decode('utf-8')
+        return item
+
+    async def compact(item):
+        item["text"], stats = compact_with_stats(item["text"])
+        counts["original_tokens"] += stats["original_tokens"]
+        counts["saved_tokens"] += stats["saved_tokens"]
+        metrics.count("input_tokens", stats["compacted_tokens"])
+        logger.debug("Compaction saved %d/%d tokens for %s", stats['saved_tokens'], stats['original_tokens'],
+                     item['file_key'], extra={'file_key': item['file_key']})
+        return item
+
+    async def summarize(item):
+        text = item.pop("text")
+        if cache is not None:
+            item["cache_key"] = cache.key_for(text)
+            if not bypass_cache:
+                item["parsed"] = await cache.get(item["cache_key"])
+                if item["parsed"] is not None:
+                    counts["cache_hits"] += 1
+                    item["cache_hit"] = True
+                    return item
+            if near_duplicates is not None:
+                item["signature"] = minhash(text)
+                item["case_numbers"] = case_numbers(text)
+                if not bypass_cache and await reuse_near_duplicate(item, text):
+                    return item
+        timings = {}
+        started = time.perf_counter()
+        item["summary"] = await summarize_text(text, llm_client, timings)
+        timings["seconds"] = time.perf_counter() - started
+        item["timings"] = timings
+        counts["llm_calls"] += timings.get("llm_calls", 0)
+        counts["early_stops"] += timings.get("early_stops", 0)
+        if "ttft" in timings:
+            counts["ttft_total"] += timings["ttft"]
+            counts["ttft_count"] += 1
+        if not item["summary"]:
+            logger.warning("Failed to generate summary for: %s", item['file_key'], extra={'file_key': item['file_key']})
+            return None
+        return item
+
+    async def reuse_near_duplicate(item, text):
+        match = await near_duplicates.find(item["signature"])
+        if match is None:
+            return False
+        source_key, similarity, source_numbers = match
+        # Near-duplicate reuse is counted on its own, not as a hit of the cache.
+        parsed = await cache.get(source_key, record_stats=False)
+        if parsed is None:
+            return False
+        item["parsed"] = adapt_summary(parsed, source_numbers, item["case_numbers"])
+        item["cache_hit"] = True
+        avoided = estimate_llm_calls(text)
+        counts["near_duplicates"] += 1
+        counts["llm_calls_avoided"] += avoided
+        await near_duplicates.record_reuse(avoided)
+        logger.info("Reusing summary of a near-duplicate (%.2f similar) for %s", similarity, item['file_key'],
+                    extra={'file_key': item['file_key']})
+        return True
+
+    async def parse(item):
+        if item.get("parsed") is not None:
+            return item
+        item["parsed"] = parse_summary(item.pop("summary"))
+        if cache is not None:
+            await cache.set(item["cache_key"], item["parsed"])
+        if near_duplicates is not None:
+            await near_duplicates.add(item["cache_key"], item.pop("signature"), item.pop("case_numbers"))
+        logger.debug("Summary generated for: %s", item['file_key'], extra={'file_key': item['file_key']})
+        return item
+
+    async def upload(item):
+        if parquet_sink is not None:
+            item["outcome"] = "pending"
+            await parquet_sink.add(summary_row(item, MODEL, PROMPT_VERSION), item)
+            return item
+        await upload_summary_to_s3(bucket_name, item["summary_key"], json.dumps(item["parsed"], ensure_ascii=False))
+        await record_summarized(item)
+        return item
+
+    async def record_summarized(item, summary_object=True):
+        # The summary is already written, so bookkeeping errors must not turn
+        # the file into a failure; at worst it is summarized again later.
+        # The summary index lists summaries/ objects only, which the Parquet
+        # sink never writes.
         try:
-            summary_key = f"{prefix}{os.path.basename(file_key)}"
-            existing_summary = await get_existing_summary(bucket_name, summary_key)
-            
-            if existing_summary and existing_summary.strip() != "Sample summary":
-                logger.info(f"Valid summary already exists for {file_key}. Skipping.")
-                summarized_files += 1
-                continue
-
-            content = await get_file_content(bucket_name, file_key)
-            logger.info(f"File content retrieved for: {file_key}")
-            
-            text_content = content.decode('utf-8')
-            summary = await summarize_text(text_content)
-            
-            if summary:
-                cleaned_summary = clean_summary(summary)
-                parsed_summary = await parse_summary(cleaned_summary)
-                logger.info(f"Summary generated for: {file_key}")
-                
-                await upload_summary_to_s3(bucket_name, summary_key, json.dumps(parsed_summary, ensure_ascii=False))
-                logger.info(f"Summary uploaded to S3 for: {file_key}")
-                
-                summarized_files += 1
-                logger.info(f"Summarized file {file_key} ({summarized_files}/{max_files})")
-            else:
-                logger.warning(f"Failed to generate summary for: {file_key}")
-            
-            if summarized_files >= max_files:
-                logger.info(f"Reached max_files limit of {max_files}")
-                break
+            if summary_object:
+                await summary_index.add(item["summary_key"])
+            if object_index is not None:
+                await object_index.record(item["object"])
+            if progress is not None:
+                await progress.add_result(item["file_key"], item["summary_key"], item["parsed"])
         except Exception as e:
-            logger.error(f"Error processing file {file_key}: {str(e)}")
-            continue
+            logger.error("Error recording summary of %s: %s", item['file_key'], e,
+                         extra={'file_key': item['file_key']})
+        counts["summarized"] += 1
+        item["outcome"] = "summarized"
+        metrics.count("files")
+        logger.info("Summarized file %s (%d/%d)", item['file_key'], counts['summarized'], max_files,
+                    extra={'file_key': item['file_key']})
+
+    async def on_commit(items):
+        for item in items:
+            await record_summarized(item, summary_object=False)
+            if checkpoint is not None:
+                await checkpoint.finish(item["seq"], "summarized")
+            if progress is not None:
+                await progress.finished("summarized")
+
+    async def on_fail(items):
+        # Not in the summary or object index, so the next run picks them up again.
+        logger.error(f"Could not write {len(items)} Parquet summaries; marking them failed")
+        for item in items:
+            item["outcome"] = "failed"
+            if checkpoint is not None:
+                await checkpoint.finish(item["seq"], "failed")
+            if progress is not None:
+                await progress.finished("failed")
 
-    logger.info(f"Completed processing. Total files summarized: {summarized_files}")
-    return {"summarized_files": summarized_files}
+    parquet_sink = None
+    if (sink or SUMMARY_SINK) == 'parquet':
+        from .parquet_sink import ParquetSink, summary_row
+        writer_id = checkpoint_id or job_id or uuid.uuid4().hex
+        parquet_sink = await ParquetSink(bucket_name, prefix, writer_id, on_commit, on_fail).open()
 
-async def get_existing_summary(bucket_name, summary_key):
+    stages = [
+        Stage('check', check, workers['check']),
+        Stage('fetch', fetch, workers['fetch']),
+        Stage('compact', compact, workers['compact']),
+        Stage('summarize', summarize, workers['summarize']),
+        Stage('parse', parse, workers['parse']),
+        Stage('upload', upload, workers['upload']),
+    ]
     try:
-        content = await get_file_content(bucket_name, summary_key)
-        return content.decode('utf-8')
-    except Exception:
-        return None
\ No newline at end of file
+        stage_stats = await run_pipeline(list_files(), stages, queue_size or PIPELINE_QUEUE_SIZE, on_done)
+        if parquet_sink is not None:
+            await parquet_sink.close()
+    except BaseException:
+        if checkpoint is not None:
+            await checkpoint.save()
+        if progress is not None:
+            await progress.flush()
+        raise
+    finally:
+        if parquet_sink is not None:
+            parquet_sink.cancel()
+        # Items still queued when the pipeline aborts never reach on_done.
+        for _ in range(permits):
+            inflight.release()
+    if progress is not None:
+        await progress.flush()
+    if checkpoint is not None:
+        if stopped:
+            await checkpoint.save()
+        else:
+            await checkpoint.clear()
+    if object_index is not None:
+        object_index.log_summary()
+    if redis_client is not None:
+        await metrics.flush(redis_client)
+
+    # Skipped files count towards the total, as they always have; so do files
+    # finished by earlier runs of a resumed job.
+    counts["skipped"] += resumed.get("skipped", 0)
+    counts["summarized"] += resumed.get("summarized", 0)
+    summarized_files = counts["skipped"] + counts["summarized"]
+    logger.info(f"Completed processing. Total files summarized: {summarized_files}. "
+                f"Compaction saved {counts['saved_tokens']}/{counts['original_tokens']} input tokens")
+    return {"summarized_files": summarized_files, "skipped_files": counts["skipped"],
+            "unchanged_files": object_index.unchanged if object_index is not None else 0,
+            "cache_hits": counts["cache_hits"], "near_duplicates": counts["near_duplicates"],
+            "llm_calls_avoided": counts["llm_calls_avoided"], "input_tokens": counts["original_tokens"],
+            "saved_tokens": counts["saved_tokens"], "llm_calls": counts["llm_calls"],
+            "early_stops": counts["early_stops"],
+            "avg_ttft": counts["ttft_total"] / counts["ttft_count"] if counts["ttft_count"] else None,
+            "llm": llm_client.stats(), "stopped": stopped, "stages": stage_stats}
+
@@ -0,0 +1,214 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = ('high', 'normal', 'low')
+# Relative share of claims each priority gets while all of them have work.
+PRIORITY_WEIGHTS = {
+    priority: int(weight) for priority, weight in
+    (pair.split(':') for pair in os.getenv('PRIORITY_WEIGHTS', 'high:6,normal:3,low:1').split(','))
+}
+# Jobs larger than this many files default to 'low'; smaller ones to 'normal'.
+BATCH_JOB_FILES = int(os.getenv('BATCH_JOB_FILES', os.getenv('SHARD_SIZE', 500)))
+# Jobs and shards one tenant may run at once across all workers while other
+# tenants have work waiting; 0 disables the cap.
+TENANT_MAX_INFLIGHT = int(os.getenv('TENANT_MAX_INFLIGHT', 8))
+# An in-flight entry not renewed within this many seconds no longer counts
+# against its tenant, so a crashed worker cannot hold a tenant's slots.
+INFLIGHT_TTL = int(os.getenv('TENANT_INFLIGHT_TTL', 120))
+
+QUEUE_KEY_PREFIX = 'fair_queue'
+TENANTS_KEY_PREFIX = 'fair_queue_tenants'
+INFLIGHT_KEY_PREFIX = 'tenant_inflight'
+CLOCK_KEY = 'fair_queue_clock'
+# One token per enqueued entry, so idle workers can block instead of polling.
+WAKEUP_KEY = 'fair_queue_wakeup'
+WAKEUP_MAX = 1000
+# Claimed jobs hold a lease here, scored by its expiry, until they finish. A
+# job whose worker stops renewing it (a crash, or SIGKILL after a slow drain)
+# is put back on its queue by reap_expired_jobs.
+JOB_LEASES = 'job_leases'
+JOB_LEASE_TTL = int(os.getenv('JOB_LEASE_TTL', 120))
+# The job list used before fair queuing; drained last so a deploy strands nothing.
+LEGACY_JOB_QUEUE = 'default'
+
+# Claim the next entry. Priorities are tried in the order given; within one,
+# tenants are served least recently served first. A tenant at its in-flight
+# cap is passed over, unless nothing else is waiting, so big jobs still use
+# spare capacity. Jobs and shards each take a lease in their own sorted set.
+# Returns {entry, tenant}, or false when there is no work.
+_CLAIM_SCRIPT = """
+local now, ttl, cap = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+
+local function claim(priority, tenant)
+    local tenants_key = ARGV[6] .. ':' .. priority
+    local queue = ARGV[7] .. ':' .. priority .. ':' .. tenant
+    local entry = redis.call('LPOP', queue)
+    if redis.call('LLEN', queue) == 0 then
+        redis.call('ZREM', tenants_key, tenant)
+    else
+        redis.call('ZADD', tenants_key, redis.call('INCR', KEYS[1]), tenant)
+    end
+    if string.sub(entry, 1, 1) == '{' then
+        redis.call('ZADD', KEYS[2], ARGV[5], entry)
+    else
+        redis.call('ZADD', KEYS[3], ARGV[4], entry)
+    end
+    redis.call('ZADD', ARGV[8] .. ':' .. tenant, now + ttl, entry)
+    return {entry, tenant}
+end
+
+local fallback
+for i = 9, #ARGV do
+    local tenants_key = ARGV[6] .. ':' .. ARGV[i]
+    for _, tenant in ipairs(redis.call('ZRANGE', tenants_key, 0, -1)) do
+        if redis.call('LLEN', ARGV[7] .. ':' .. ARGV[i] .. ':' .. tenant) == 0 then
+            redis.call('ZREM', tenants_key, tenant)
+        else
+            local inflight = ARGV[8] .. ':' .. tenant
+            redis.call('ZREMRANGEBYSCORE', inflight, '-inf', now)
+            if cap <= 0 or redis.call('ZCARD', inflight) < cap then
+                return claim(ARGV[i], tenant)
+            end
+            fallback = fallback or {ARGV[i], tenant}
+        end
+    end
+end
+if fallback then
+    return claim(fallback[1], fallback[2])
+end
+
+local entry = redis.call('LPOP', KEYS[4])
+if not entry then
+    return false
+end
+redis.call('ZADD', KEYS[2], ARGV[5], entry)
+return {entry, ''}
+"""
+
+
+def queue_key(priority, tenant):
+    return f"{QUEUE_KEY_PREFIX}:{priority}:{tenant}"
+
+
+def tenants_key(priority):
+    return f"{TENANTS_KEY_PREFIX}:{priority}"
+
+
+def inflight_key(tenant):
+    return f"{INFLIGHT_KEY_PREFIX}:{tenant}"
+
+
+def job_tenant(job):
+    """Tenants default to the bucket, so each bucket gets its own share."""
+    return job.get('tenant') or job['bucket_name']
+
+
+def job_priority(job):
+    if job.get('priority') in PRIORITIES:
+        return job['priority']
+    return 'low' if job.get('max_files', 100) > BATCH_JOB_FILES else 'normal'
+
+
+def is_job(entry):
+    """Queue entries are either a job's JSON or a shard id."""
+    return entry[:1] in (b'{', '{')
+
+
+def push(pipe, entry, job, head=False):
+    """Add the commands that enqueue `entry` for `job`'s tenant and priority to `pipe`."""
+    priority, tenant = job_priority(job), job_tenant(job)
+    if head:
+        pipe.lpush(queue_key(priority, tenant), entry)
+    else:
+        pipe.rpush(queue_key(priority, tenant), entry)
+    # New tenants score 0 and so are served ahead of those already being served.
+    pipe.zadd(tenants_key(priority), {tenant: 0}, nx=True)
+    pipe.rpush(WAKEUP_KEY, 1)
+    pipe.ltrim(WAKEUP_KEY, 0, WAKEUP_MAX - 1)
+
+
+class PriorityRotation:
+    """Smooth weighted round-robin over the priorities.
+
+    Each call to `order` puts the priority whose turn it is first, followed by
+    the rest by weight, so a claim falls through to lower priorities when the
+    preferred one is empty. With weights 6:3:1 and all queues busy, high gets
+    six claims in ten, spread out rather than in a burst.
+    """
+
+    def __init__(self, weights=None):
+        self.weights = weights or PRIORITY_WEIGHTS
+        self.current = dict.fromkeys(PRIORITIES, 0)
+
+    def order(self):
+        total = sum(self.weights.get(priority, 1) for priority in PRIORITIES)
+        for priority in PRIORITIES:
+            self.current[priority] += self.weights.get(priority, 1)
+        first = max(PRIORITIES, key=lambda priority: self.current[priority])
+        self.current[first] -= total
+        return [first] + sorted((p for p in PRIORITIES if p != first),
+                                key=lambda priority: -self.weights.get(priority, 1))
+
+
+async def claim(redis_client, priorities, leases_key, lease_ttl):
+    """Claim the next job or shard; returns (entry, tenant) or None."""
+    now = time.time()
+    claimed = await redis_client.eval(
+        _CLAIM_SCRIPT, 4, CLOCK_KEY, JOB_LEASES, leases_key, LEGACY_JOB_QUEUE,
+        now, INFLIGHT_TTL, TENANT_MAX_INFLIGHT, now + lease_ttl, now + JOB_LEASE_TTL,
+        TENANTS_KEY_PREFIX, QUEUE_KEY_PREFIX, INFLIGHT_KEY_PREFIX, *priorities)
+    if not claimed:
+        return None
+    entry, tenant = claimed
+    return entry, tenant.decode('utf-8') if isinstance(tenant, bytes) else tenant
+
+
+async def wait_for_work(redis_client, timeout):
+    await redis_client.blpop(WAKEUP_KEY, timeout)
+
+
+async def keepalive(redis_client, tenant, entry):
+    """Keep `entry` counted against `tenant`, and a job's lease, until cancelled."""
+    if not tenant and not is_job(entry):
+        return
+    while True:
+        await asyncio.sleep(min(INFLIGHT_TTL, JOB_LEASE_TTL) / 3)
+        now = time.time()
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                if tenant:
+                    pipe.zadd(inflight_key(tenant), {entry: now + INFLIGHT_TTL}, xx=True)
+                if is_job(entry):
+                    pipe.zadd(JOB_LEASES, {entry: now + JOB_LEASE_TTL}, xx=True)
+                await pipe.execute()
+        except Exception as e:
+            # Keep trying; a lease only lapses if renewals fail for a whole TTL.
+            logger.warning(f"Error renewing lease: {str(e)}")
+
+
+async def release(redis_client, tenant, entry):
+    if tenant:
+        await redis_client.zrem(inflight_key(tenant), entry)
+
+
+
+async def reap_expired_jobs(redis_client):
+    """Put every job whose lease has expired back onto its queue."""
+    reaped = 0
+    for entry in await redis_client.zrangebyscore(JOB_LEASES, '-inf', time.time()):
+        # Only the worker whose ZREM succeeds requeues, so concurrent reapers
+        # cannot queue a job twice.
+        if not await redis_client.zrem(JOB_LEASES, entry):
+            continue
+        async with redis_client.pipeline(transaction=True) as pipe:
+            push(pipe, entry, json.loads(entry), head=True)
+            await pipe.execute()
+        reaped += 1
+    if reaped:
+        logger.warning(f"Requeued {reaped} jobs with expired leases")
+    return reaped
@@ -0,0 +1,228 @@
+import aiohttp
+import asyncio
+import json
+import logging
+import os
+import ssl
+import time
+import certifi
+from .rate_limit import AIMDLimiter, TokenBucket
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+API_KEY = os.getenv("TOGETHER_API_KEY")
+API_URL = os.getenv("LLM_API_URL", "https://api.together.xyz/inference")
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', 64))
+LLM_MAX_CONNECTIONS_PER_HOST = int(os.getenv('LLM_MAX_CONNECTIONS_PER_HOST', 32))
+LLM_KEEPALIVE_TIMEOUT = float(os.getenv('LLM_KEEPALIVE_TIMEOUT', 60))
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', 10))
+LLM_REQUEST_TIMEOUT = float(os.getenv('LLM_REQUEST_TIMEOUT', 180))
+# Request quota and adaptive concurrency bounds for the inference API.
+LLM_RATE_LIMIT = float(os.getenv('LLM_RATE_LIMIT', 10))
+LLM_BURST = float(os.getenv('LLM_BURST', 20))
+LLM_INITIAL_CONCURRENCY = int(os.getenv('LLM_INITIAL_CONCURRENCY', 4))
+LLM_MIN_CONCURRENCY = int(os.getenv('LLM_MIN_CONCURRENCY', 1))
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 32))
+LLM_TARGET_LATENCY = float(os.getenv('LLM_TARGET_LATENCY', 30))
+# Stream completions token by token so they can be cut off once the summary is complete.
+LLM_STREAM = os.getenv('LLM_STREAM', 'true').lower() in ('1', 'true', 'yes')
+
+# Create SSL context
+ssl_context = ssl.create_default_context(cafile=certifi.where())
+
+
+class LLMError(Exception):
+    """The inference API rejected the request; retrying will not help."""
+
+
+class TransientLLMError(LLMError):
+    """A failure worth retrying: timeouts, connection errors and 5xx responses."""
+
+
+class RateLimitedError(TransientLLMError):
+    """The API answered 429; `retry_after` is its Retry-After in seconds, if given."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _retry_after(response):
+    value = response.headers.get('Retry-After')
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class LLMClient:
+    """Keep-alive HTTP client for the Together inference API.
+
+    Open it once and share it between all summarize calls:
+
+        async with LLMClient() as llm:
+            summary = await summarize_text(text, llm)
+
+    Connections are pooled per host and reused across requests, so only the
+    first call pays for DNS, TCP and TLS setup. Point `api_url` at a local
+    server to run against a fake backend.
+
+    Every request passes a token bucket (the API quota) and an AIMD limiter
+    that adapts the number of requests in flight to observed latency and
+    throttling. Failures are raised as LLMError subclasses, so callers can
+    retry only the transient ones.
+    """
+
+    def __init__(self, api_url=None, api_key=None, max_connections=None, max_connections_per_host=None,
+                 connect_timeout=None, request_timeout=None, rate_limit=None, limiter=None):
+        self.api_url = api_url or API_URL
+        self.api_key = api_key or API_KEY
+        self.max_connections = max_connections or LLM_MAX_CONNECTIONS
+        self.max_connections_per_host = max_connections_per_host or LLM_MAX_CONNECTIONS_PER_HOST
+        self.timeout = aiohttp.ClientTimeout(
+            total=request_timeout or LLM_REQUEST_TIMEOUT,
+            sock_connect=connect_timeout or LLM_CONNECT_TIMEOUT,
+        )
+        self.session = None
+        self.rate_limiter = TokenBucket(rate_limit or LLM_RATE_LIMIT, LLM_BURST)
+        self.limiter = limiter or AIMDLimiter(LLM_INITIAL_CONCURRENCY, LLM_MIN_CONCURRENCY, LLM_MAX_CONCURRENCY,
+                                              LLM_TARGET_LATENCY)
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(
+            ssl=ssl_context if self.api_url.startswith('https') else False,
+            limit=self.max_connections,
+            limit_per_host=self.max_connections_per_host,
+            keepalive_timeout=LLM_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=300,
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=self.timeout,
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            },
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def stats(self):
+        return self.limiter.stats()
+
+    async def _check_status(self, response):
+        """Raise the matching LLMError for a failed response, releasing the limiter slot."""
+        if response.status == 429:
+            retry_after = _retry_after(response)
+            await self.limiter.release(throttled=True, retry_after=retry_after)
+            raise RateLimitedError("LLM API rate limit exceeded", retry_after)
+        if response.status >= 500:
+            await self.limiter.release(error=True)
+            raise TransientLLMError(f"LLM API returned HTTP {response.status}")
+        if response.status >= 400:
+            # Read the body before releasing: a read error must not reach the
+            # callers' handlers, which would release the slot a second time.
+            try:
+                body = await response.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError, UnicodeDecodeError) as e:
+                body = f"<unreadable body: {str(e) or type(e).__name__}>"
+            await self.limiter.release()
+            raise LLMError(f"LLM API returned HTTP {response.status}: {body}")
+
+    async def complete(self, payload):
+        """POST `payload` to the inference endpoint and return the decoded JSON body."""
+        if self.session is None:
+            raise RuntimeError("LLMClient is not open; use 'async with LLMClient()'")
+        await self.rate_limiter.acquire()
+        await self.limiter.acquire()
+        started = time.monotonic()
+        try:
+            async with self.session.post(self.api_url, json=payload) as response:
+                await self._check_status(response)
+                data = await response.json(content_type=None)
+        except LLMError:
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            await self.limiter.release(error=True)
+            raise TransientLLMError(f"LLM API request failed: {str(e) or type(e).__name__}") from e
+        except asyncio.CancelledError:
+            await self.limiter.release(cancelled=True)
+            raise
+        except BaseException:
+            await self.limiter.release(error=True)
+            raise
+        await self.limiter.release(latency=time.monotonic() - started)
+        metrics.observe(f"llm:{payload.get('model')}", time.monotonic() - started)
+        return data
+
+    async def stream(self, payload, timings=None):
+        """POST `payload` as a streaming request and yield completion text as it arrives.
+
+        Stop iterating (inside `contextlib.aclosing`) to abandon the rest of
+        the completion: the connection is closed so the server stops
+        generating. When `timings` is a dict, `ttft` (time to first token)
+        and `total` are recorded in it, in seconds.
+        """
+        if self.session is None:
+            raise RuntimeError("LLMClient is not open; use 'async with LLMClient()'")
+        await self.rate_limiter.acquire()
+        await self.limiter.acquire()
+        started = time.monotonic()
+        first_token = None
+        finished = False
+        try:
+            async with self.session.post(self.api_url, json={**payload, "stream": True, "stream_tokens": True}) as response:
+                await self._check_status(response)
+                try:
+                    async for line in response.content:
+                        if not line.startswith(b'data:'):
+                            continue
+                        data = line[5:].strip()
+                        if data == b'[DONE]':
+                            break
+                        event = json.loads(data)
+                        choices = event.get('choices') or [event.get('token') or {}]
+                        text = choices[0].get('text')
+                        if not text:
+                            continue
+                        if first_token is None:
+                            first_token = time.monotonic() - started
+                            metrics.observe(f"llm_ttft:{payload.get('model')}", first_token)
+                            if timings is not None:
+                                timings['ttft'] = first_token
+                        yield text
+                    finished = True
+                finally:
+                    if not finished:
+                        # Abandoned early: drop the connection rather than draining the stream.
+                        response.close()
+        except LLMError:
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            await self.limiter.release(error=True)
+            raise TransientLLMError(f"LLM API request failed: {str(e) or type(e).__name__}") from e
+        except GeneratorExit:
+            await self.limiter.release(latency=time.monotonic() - started)
+            metrics.observe(f"llm:{payload.get('model')}", time.monotonic() - started)
+            if timings is not None:
+                timings['total'] = time.monotonic() - started
+            raise
+        except asyncio.CancelledError:
+            # Shutdown or a sibling chunk failing; not a sign of an overloaded API.
+            await self.limiter.release(cancelled=True)
+            raise
+        except BaseException:
+            await self.limiter.release(error=True)
+            raise
+        await self.limiter.release(latency=time.monotonic() - started)
+        metrics.observe(f"llm:{payload.get('model')}", time.monotonic() - started)
+        if timings is not None:
+            timings['total'] = time.monotonic() - started
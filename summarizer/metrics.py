@@ -0,0 +1,176 @@
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+HISTOGRAM_KEY_PREFIX = 'latency'
+# Set of every histogram name, so readers never have to scan for keys.
+HISTOGRAM_INDEX_KEY = 'latency_histograms'
+THROUGHPUT_KEY_PREFIX = 'throughput'
+# Throughput is reported over this many trailing minutes.
+THROUGHPUT_WINDOW = int(os.getenv('THROUGHPUT_WINDOW', 15))
+THROUGHPUT_TTL = 24 * 3600
+# Seconds between flushes from a running worker.
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 10))
+
+# Upper bounds of the latency buckets, in seconds: 1 ms to about 11 minutes in
+# steps of 1.5x. Every process uses the same bounds, so histograms from all
+# workers add up bucket by bucket. The last bucket holds everything above.
+BUCKET_BOUNDS = tuple(0.001 * 1.5 ** i for i in range(34))
+
+# Merge one process's histogram into Redis. KEYS[1] is the histogram hash;
+# ARGV is count, sum, min, max and then bucket/count pairs.
+_MERGE_SCRIPT = """
+redis.call('HINCRBY', KEYS[1], 'count', ARGV[1])
+redis.call('HINCRBYFLOAT', KEYS[1], 'sum', ARGV[2])
+local low = redis.call('HGET', KEYS[1], 'min')
+if not low or tonumber(ARGV[3]) < tonumber(low) then
+    redis.call('HSET', KEYS[1], 'min', ARGV[3])
+end
+local high = redis.call('HGET', KEYS[1], 'max')
+if not high or tonumber(ARGV[4]) > tonumber(high) then
+    redis.call('HSET', KEYS[1], 'max', ARGV[4])
+end
+for i = 5, #ARGV, 2 do
+    redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+return 1
+"""
+
+
+def _bucket(seconds):
+    for i, bound in enumerate(BUCKET_BOUNDS):
+        if seconds <= bound:
+            return i
+    return len(BUCKET_BOUNDS)
+
+
+class _Histogram:
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, seconds):
+        bucket = _bucket(seconds)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.sum += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+
+# Samples recorded in this process since the last flush.
+_histograms = {}
+_counters = {}
+
+
+def observe(name, seconds):
+    """Record one latency sample, in seconds, under histogram `name`."""
+    histogram = _histograms.get(name)
+    if histogram is None:
+        histogram = _histograms[name] = _Histogram()
+    histogram.add(seconds)
+
+
+def count(name, amount=1):
+    """Add to a throughput counter (files, input_tokens, ...) for the current minute."""
+    _counters[name] = _counters.get(name, 0) + amount
+
+
+class timed:
+    """Context manager that observes the time spent inside it under `name`."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.name, time.perf_counter() - self.started)
+
+
+async def flush(redis_client):
+    """Merge everything recorded since the last flush into Redis."""
+    global _histograms, _counters
+    histograms, _histograms = _histograms, {}
+    counters, _counters = _counters, {}
+    if not histograms and not counters:
+        return
+    minute_key = f"{THROUGHPUT_KEY_PREFIX}:{int(time.time() // 60)}"
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for name, histogram in histograms.items():
+            args = [histogram.count, histogram.sum, histogram.min, histogram.max]
+            for bucket, bucket_count in histogram.buckets.items():
+                args += [bucket, bucket_count]
+            pipe.eval(_MERGE_SCRIPT, 1, f"{HISTOGRAM_KEY_PREFIX}:{name}", *args)
+        if histograms:
+            pipe.sadd(HISTOGRAM_INDEX_KEY, *histograms)
+        for name, amount in counters.items():
+            pipe.hincrby(minute_key, name, amount)
+        if counters:
+            pipe.expire(minute_key, THROUGHPUT_TTL)
+        await pipe.execute()
+
+
+def _decode(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def percentiles(data, quantiles=(0.5, 0.9, 0.99)):
+    """Summarize a histogram hash from Redis: count, mean, min, max and percentiles.
+
+    Percentiles are interpolated linearly inside the bucket they fall in,
+    so they are accurate to within one bucket (a factor of 1.5).
+    """
+    data = {_decode(k): _decode(v) for k, v in data.items()}
+    total = int(data.get('count', 0))
+    if not total:
+        return {"count": 0}
+    low, high = float(data['min']), float(data['max'])
+    counts = [int(data.get(str(i), 0)) for i in range(len(BUCKET_BOUNDS) + 1)]
+    summary = {"count": total, "mean": float(data['sum']) / total, "min": low, "max": high}
+    for q in quantiles:
+        rank = q * total
+        seen = 0
+        for i, bucket_count in enumerate(counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = max(BUCKET_BOUNDS[i - 1] if i else 0.0, low)
+                upper = min(BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else high, high)
+                value = lower + (upper - lower) * (rank - seen) / bucket_count
+                break
+            seen += bucket_count
+        summary[f"p{round(q * 100)}"] = value
+    return summary
+
+
+def read_histograms(redis_client):
+    """Percentile summaries of every histogram, read with one pipeline (sync client)."""
+    names = sorted(_decode(name) for name in redis_client.smembers(HISTOGRAM_INDEX_KEY))
+    with redis_client.pipeline(transaction=False) as pipe:
+        for name in names:
+            pipe.hgetall(f"{HISTOGRAM_KEY_PREFIX}:{name}")
+        return {name: percentiles(data) for name, data in zip(names, pipe.execute())}
+
+
+def read_throughput(redis_client, window=None):
+    """Per-second and per-minute rates of each counter over the trailing window (sync client)."""
+    window = window or THROUGHPUT_WINDOW
+    current = int(time.time() // 60)
+    with redis_client.pipeline(transaction=False) as pipe:
+        for minute in range(current - window + 1, current + 1):
+            pipe.hgetall(f"{THROUGHPUT_KEY_PREFIX}:{minute}")
+        totals = {}
+        for data in pipe.execute():
+            for name, amount in data.items():
+                totals[_decode(name)] = totals.get(_decode(name), 0) + int(amount)
+    throughput = {"window_minutes": window}
+    for name, total in totals.items():
+        throughput[f"{name}_per_min"] = total / window
+        throughput[f"{name}_per_sec"] = total / (window * 60)
+    return throughput
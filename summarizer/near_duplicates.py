@@ -0,0 +1,164 @@
+import hashlib
+import logging
+import os
+import re
+import unicodedata
+import zlib
+import numpy as np
+from .cache import CACHE_STATS_KEY, SUMMARY_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+NEAR_DUPLICATES = os.getenv('NEAR_DUPLICATES', '1') != '0'
+# Estimated Jaccard similarity of word shingles above which a summary is reused.
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv('NEAR_DUPLICATE_THRESHOLD', 0.9))
+SHINGLE_SIZE = 5
+NUM_PERMUTATIONS = 128
+# 16 bands of 8 rows: texts at similarity 0.9 share a band with probability
+# 0.9999, at 0.7 with 0.6 and at 0.5 with 0.06, so candidates are few and the
+# threshold check on the full signature decides.
+LSH_BANDS = 16
+# Shingles are hashed through the permutations this many at a time, which
+# bounds the temporary array for very long decisions.
+SHINGLE_BLOCK = 4096
+
+BAND_KEY_PREFIX = 'near_dup_band'
+SIGNATURE_KEY_PREFIX = 'near_dup'
+
+_PRIME = (1 << 31) - 1
+_rng = np.random.RandomState(20240917)
+_A = _rng.randint(1, _PRIME, NUM_PERMUTATIONS).astype(np.uint64)[:, None]
+_B = _rng.randint(0, _PRIME, NUM_PERMUTATIONS).astype(np.uint64)[:, None]
+
+_WORD = re.compile(r'\w+')
+_DIGIT = re.compile(r'\d')
+# Esas and karar numbers such as 2019/1234; the parts of a decision that
+# differ between otherwise identical copies and that summaries quote.
+_CASE_NUMBER = re.compile(r'\b(?:19|20)\d{2}/\d+\b')
+
+
+def shingles(text):
+    """Hashes of the overlapping word 5-grams of `text`, with digits masked."""
+    words = _WORD.findall(_DIGIT.sub('0', unicodedata.normalize('NFC', text).casefold()))
+    if len(words) < SHINGLE_SIZE:
+        words = [' '.join(words)]
+    grams = {' '.join(words[i:i + SHINGLE_SIZE]) for i in range(max(1, len(words) - SHINGLE_SIZE + 1))}
+    return np.fromiter((zlib.crc32(gram.encode('utf-8')) for gram in grams), dtype=np.uint64, count=len(grams))
+
+
+def minhash(text):
+    """MinHash signature of `text`: NUM_PERMUTATIONS uint32 values."""
+    values = shingles(text) % _PRIME
+    signature = np.full(NUM_PERMUTATIONS, _PRIME, dtype=np.uint64)
+    for start in range(0, len(values), SHINGLE_BLOCK):
+        block = values[start:start + SHINGLE_BLOCK][None, :]
+        np.minimum(signature, ((_A * block + _B) % _PRIME).min(axis=1), out=signature)
+    return signature.astype(np.uint32)
+
+
+def case_numbers(text, limit=8):
+    """The first distinct esas/karar numbers in `text`, in order."""
+    return list(dict.fromkeys(_CASE_NUMBER.findall(text)))[:limit]
+
+
+def adapt_summary(parsed, source_numbers, target_numbers):
+    """Swap the source decision's case numbers for the target's in a reused summary.
+
+    Numbers are matched by position, and only when both decisions cite the
+    same count of them; otherwise the summary is returned unchanged.
+    """
+    mapping = {old: new for old, new in zip(source_numbers, target_numbers) if old != new}
+    if not mapping or len(source_numbers) != len(target_numbers):
+        return parsed
+    pattern = re.compile('|'.join(re.escape(number) for number in mapping))
+    return {key: pattern.sub(lambda match: mapping[match.group(0)], value) if isinstance(value, str) else value
+            for key, value in parsed.items()}
+
+
+class NearDuplicateIndex:
+    """MinHash signatures of summarized decisions, with an LSH band index in Redis.
+
+    Each summarized text sets one `near_dup_band:{hash}` key per band,
+    mapping a hash of the band's rows to the text's summary cache key, and
+    stores its signature and case numbers under `near_dup:{digest}`. All of
+    them carry the cache's TTL, so the index ages out with the summaries it
+    points at; a match renews them, as a cache hit does. Band hashes include
+    the model and prompt version, so summaries from an older prompt are
+    never offered. A lookup is one MGET over the bands and one read per
+    distinct candidate.
+    """
+
+    def __init__(self, redis_client, model, prompt_version, threshold=None, ttl=None):
+        self.redis = redis_client
+        self.namespace = f"{model}\0{prompt_version}".encode('utf-8')
+        self.threshold = threshold or NEAR_DUPLICATE_THRESHOLD
+        self.ttl = ttl or SUMMARY_CACHE_TTL
+
+    def band_keys(self, signature):
+        rows = NUM_PERMUTATIONS // LSH_BANDS
+        return [f"{BAND_KEY_PREFIX}:" + hashlib.blake2b(
+                    self.namespace + bytes([band]) + signature[band * rows:(band + 1) * rows].tobytes(),
+                    digest_size=8).hexdigest()
+                for band in range(LSH_BANDS)]
+
+    @staticmethod
+    def signature_key(cache_key):
+        return f"{SIGNATURE_KEY_PREFIX}:{cache_key.rpartition(':')[2]}"
+
+    async def find(self, signature):
+        """Return (cache_key, similarity, case_numbers) of the closest indexed text
+        at or above the threshold, or None."""
+        try:
+            candidates = {key for key in await self.redis.mget(self.band_keys(signature)) if key}
+            if not candidates:
+                return None
+            candidates = [key.decode('utf-8') for key in candidates]
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for cache_key in candidates:
+                    pipe.hmget(self.signature_key(cache_key), 'signature', 'case_numbers')
+                records = await pipe.execute()
+        except Exception as e:
+            logger.error(f"Error reading near-duplicate index: {str(e)}")
+            return None
+        best, best_signature = None, None
+        for cache_key, (stored, numbers) in zip(candidates, records):
+            if stored is None:
+                continue
+            stored = np.frombuffer(stored, dtype=np.uint32)
+            similarity = float(np.mean(stored == signature))
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (cache_key, similarity, numbers.decode('utf-8').split(' ') if numbers else [])
+                best_signature = stored
+        if best is not None:
+            await self._renew(best[0], best_signature)
+        return best
+
+    async def _renew(self, cache_key, signature):
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key in [*self.band_keys(signature), self.signature_key(cache_key)]:
+                    pipe.expire(key, self.ttl)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Error renewing near-duplicate index: {str(e)}")
+
+    async def add(self, cache_key, signature, numbers):
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key in self.band_keys(signature):
+                    pipe.set(key, cache_key, ex=self.ttl)
+                pipe.hset(self.signature_key(cache_key),
+                          mapping={'signature': signature.tobytes(), 'case_numbers': ' '.join(numbers)})
+                pipe.expire(self.signature_key(cache_key), self.ttl)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Error writing near-duplicate index: {str(e)}")
+
+    async def record_reuse(self, llm_calls_avoided):
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.hincrby(CACHE_STATS_KEY, 'near_duplicate_hits', 1)
+                pipe.hincrby(CACHE_STATS_KEY, 'llm_calls_avoided', llm_calls_avoided)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Error recording near-duplicate reuse: {str(e)}")
@@ -0,0 +1,82 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+INDEX_KEY = 'object_index'
+# Listing entries are looked up in Redis this many at a time.
+LOOKUP_BATCH_SIZE = 500
+
+
+class ObjectIndex:
+    """ETag of every source object already summarized under a bucket/prefix.
+
+    Incremental jobs pass their listing through `changed()`, which only lets
+    through objects that are new or whose ETag differs from the recorded one,
+    so a daily run costs one LIST pass plus work proportional to the delta.
+    `record()` stores an object's ETag once its summary is in place.
+
+    Objects summarized before the index existed have no ETag recorded.
+    Given a `summarized` lookup, `changed()` records those directly
+    instead of yielding them, so the first incremental runs over an existing
+    corpus spend their budget on new decisions rather than on re-indexing
+    old ones.
+    """
+
+    def __init__(self, redis_client, bucket, prefix):
+        self.redis = redis_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.listed = 0
+        self.unchanged = 0
+        self.adopted = 0
+
+    @property
+    def redis_key(self):
+        return f"{INDEX_KEY}:{self.bucket}:{self.prefix}"
+
+    async def changed(self, objects, summarized=None):
+        """Yield `(entry, changed)` for each listing entry that is new or changed.
+
+        `changed` is True when the object was summarized before under a
+        different ETag, meaning its existing summary is stale. When given,
+        `await summarized(entries)` returns whether each new object already
+        has a summary; those are recorded under their current ETag and not
+        yielded.
+        """
+        batch = []
+        async for entry in objects:
+            batch.append(entry)
+            if len(batch) >= LOOKUP_BATCH_SIZE:
+                for result in await self._filter(batch, summarized):
+                    yield result
+                batch = []
+        if batch:
+            for result in await self._filter(batch, summarized):
+                yield result
+
+    async def _filter(self, batch, summarized):
+        self.listed += len(batch)
+        recorded = await self.redis.hmget(self.redis_key, [entry['Key'] for entry in batch])
+        new = [entry for entry, etag in zip(batch, recorded) if etag is None]
+        found = await summarized(new) if summarized is not None else [False] * len(new)
+        adopted = {entry['Key']: entry['ETag'] for entry, has_summary in zip(new, found) if has_summary}
+        results = []
+        for entry, etag in zip(batch, recorded):
+            if etag is None:
+                if entry['Key'] not in adopted:
+                    results.append((entry, False))
+            elif etag.decode('utf-8') != entry['ETag']:
+                results.append((entry, True))
+            else:
+                self.unchanged += 1
+        if adopted:
+            await self.redis.hset(self.redis_key, mapping=adopted)
+            self.adopted += len(adopted)
+        return results
+
+    async def record(self, entry):
+        await self.redis.hset(self.redis_key, entry['Key'], entry['ETag'])
+
+    def log_summary(self):
+        logger.info(f"Incremental listing of {self.bucket}/{self.prefix}: {self.listed} objects, "
+                    f"{self.unchanged} unchanged, {self.adopted} already summarized and indexed")
@@ -0,0 +1,195 @@
+import asyncio
+import io
+import json
+import logging
+import os
+import time
+import pyarrow as pa
+import pyarrow.parquet as pq
+from .s3_handler import get_file_content, put_object
+
+logger = logging.getLogger(__name__)
+
+# Parquet parts and manifests are written under this prefix, mirroring the source prefix.
+PARQUET_PREFIX = 'summaries-parquet/'
+# A part is flushed once it holds this many rows or bytes of summary text, or
+# once its oldest row is this many seconds old.
+PARQUET_MAX_ROWS = int(os.getenv('PARQUET_MAX_ROWS', 5000))
+PARQUET_MAX_BYTES = int(os.getenv('PARQUET_MAX_BYTES', 32 * 1024 * 1024))
+PARQUET_MAX_AGE = float(os.getenv('PARQUET_MAX_AGE', 300))
+PARQUET_COMPRESSION = os.getenv('PARQUET_COMPRESSION', 'zstd')
+# After a failed upload the rows stay buffered and are retried no sooner than this.
+PARQUET_RETRY_DELAY = float(os.getenv('PARQUET_RETRY_DELAY', 5))
+
+SECTION_COLUMNS = {
+    "Dava Konusu": "dava_konusu",
+    "Hukuki Dayanak": "hukuki_dayanak",
+    "Mahkeme Kararı": "mahkeme_karari",
+    "Kararın Gerekçesi": "kararin_gerekcesi",
+}
+
+SCHEMA = pa.schema([
+    ("source_key", pa.string()),
+    ("summary_key", pa.string()),
+    *((column, pa.string()) for column in SECTION_COLUMNS.values()),
+    ("tam_ozet_metni", pa.string()),
+    ("model", pa.string()),
+    ("prompt_version", pa.string()),
+    ("cache_hit", pa.bool_()),
+    ("llm_calls", pa.int32()),
+    ("ttft_seconds", pa.float64()),
+    ("summarize_seconds", pa.float64()),
+    ("created_at", pa.timestamp('ms', tz='UTC')),
+])
+
+
+def summary_row(item, model, prompt_version):
+    """Flatten a finished pipeline item into one Parquet row."""
+    parsed = item["parsed"]
+    timings = item.get("timings", {})
+    row = {
+        "source_key": item["file_key"],
+        "summary_key": item["summary_key"],
+        "tam_ozet_metni": parsed.get("Tam Ozet Metni"),
+        "model": model,
+        "prompt_version": prompt_version,
+        "cache_hit": item.get("cache_hit", False),
+        "llm_calls": timings.get("llm_calls", 0),
+        "ttft_seconds": timings.get("ttft"),
+        "summarize_seconds": timings.get("seconds"),
+        "created_at": int(time.time() * 1000),
+    }
+    for section, column in SECTION_COLUMNS.items():
+        row[column] = parsed.get(section)
+    return row
+
+
+def _encode(rows):
+    table = pa.Table.from_pylist(rows, schema=SCHEMA)
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression=PARQUET_COMPRESSION)
+    return buffer.getvalue()
+
+
+class ParquetSink:
+    """Buffers summaries and writes them to S3 as compressed Parquet parts.
+
+    Each writer (a job or a shard) owns a manifest at
+    `summaries-parquet/{prefix}_manifests/{writer_id}.json` that lists the
+    parts it has committed. A part counts only once it is in the manifest,
+    so readers that go through the manifests never see a half-written or
+    orphaned part. Part names are numbered from the manifest, so a writer
+    that restarts overwrites any part it uploaded but never committed.
+
+    `on_commit(items)` is awaited with the pipeline items of each committed
+    part. The job marks files done there, not when they enter the buffer,
+    so a crash before a flush leaves them to be summarized again rather
+    than lost. A part that fails to upload stays buffered and is retried;
+    if it still cannot be written on close, its items are passed to
+    `on_fail(items)` instead.
+
+    While open, a timer flushes the buffer once its oldest row reaches
+    `max_age`, even if no more rows arrive.
+    """
+
+    def __init__(self, bucket, prefix, writer_id, on_commit, on_fail, max_rows=None, max_bytes=None,
+                 max_age=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.writer_id = writer_id
+        self.on_commit = on_commit
+        self.on_fail = on_fail
+        self.max_rows = max_rows or PARQUET_MAX_ROWS
+        self.max_bytes = max_bytes or PARQUET_MAX_BYTES
+        self.max_age = max_age or PARQUET_MAX_AGE
+        self.parts = []
+        self._rows = []
+        self._items = []
+        self._bytes = 0
+        self._oldest = None
+        self._retry_at = 0.0
+        self._lock = asyncio.Lock()
+        self._timer = None
+
+    @property
+    def manifest_key(self):
+        return f"{PARQUET_PREFIX}{self.prefix}_manifests/{self.writer_id}.json"
+
+    def part_key(self, number):
+        return f"{PARQUET_PREFIX}{self.prefix}{self.writer_id}/part-{number:05d}.parquet"
+
+    async def open(self):
+        manifest = await get_file_content(self.bucket, self.manifest_key)
+        if manifest is not None:
+            self.parts = json.loads(manifest)["parts"]
+            logger.info(f"Resuming Parquet output for {self.writer_id} after {len(self.parts)} committed parts")
+        self._timer = asyncio.create_task(self._flush_when_due())
+        return self
+
+    def _due(self):
+        if not self._rows or time.monotonic() < self._retry_at:
+            return False
+        return (len(self._rows) >= self.max_rows or self._bytes >= self.max_bytes
+                or time.monotonic() - self._oldest >= self.max_age)
+
+    async def _flush_when_due(self):
+        while True:
+            await asyncio.sleep(min(self.max_age, PARQUET_RETRY_DELAY))
+            if self._due():
+                try:
+                    await self.flush()
+                except Exception as e:
+                    logger.error(f"Error flushing Parquet output for {self.writer_id}: {str(e)}")
+
+    async def add(self, row, item):
+        self._rows.append(row)
+        self._items.append(item)
+        self._bytes += sum(len(value) for value in row.values() if isinstance(value, str))
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+        if self._due():
+            await self.flush()
+
+    async def flush(self):
+        """Write the buffered rows as one part; returns False if the upload failed,
+        in which case the rows are buffered again for a later attempt."""
+        async with self._lock:
+            if not self._rows:
+                return True
+            rows, items, size, oldest = self._rows, self._items, self._bytes, self._oldest
+            self._rows, self._items, self._bytes, self._oldest = [], [], 0, None
+
+            key = self.part_key(len(self.parts))
+            try:
+                body = await asyncio.to_thread(_encode, rows)
+                await put_object(self.bucket, key, body)
+                parts = self.parts + [{"key": key, "rows": len(rows), "bytes": len(body),
+                                       "committed_at": time.time()}]
+                manifest = {"writer": self.writer_id, "bucket": self.bucket, "prefix": self.prefix, "parts": parts}
+                await put_object(self.bucket, self.manifest_key, json.dumps(manifest).encode('utf-8'))
+            except Exception as e:
+                # Rows added meanwhile are newer, so the failed ones go back in front.
+                self._rows, self._items = rows + self._rows, items + self._items
+                self._bytes += size
+                self._oldest = oldest
+                self._retry_at = time.monotonic() + PARQUET_RETRY_DELAY
+                logger.error(f"Error committing {len(rows)} summaries to {key}; will retry: {str(e)}")
+                return False
+            self.parts = parts
+            logger.info(f"Committed {len(rows)} summaries to {key} ({len(body)} bytes)")
+        await self.on_commit(items)
+        return True
+
+    def cancel(self):
+        """Stop the flush timer without writing what is still buffered."""
+        if self._timer is not None:
+            self._timer.cancel()
+
+    async def close(self):
+        self.cancel()
+        if await self.flush():
+            return
+        async with self._lock:
+            items = self._items
+            self._rows, self._items, self._bytes, self._oldest = [], [], 0, None
+        await self.on_fail(items)
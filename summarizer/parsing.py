@@ -0,0 +1,178 @@
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+SECTION_NAMES = ("Dava Konusu", "Hukuki Dayanak", "Mahkeme Kararı", "Kararın Gerekçesi")
+
+# A section heading, either as a JSON key ("Dava Konusu": ) or a text label (Dava Konusu:).
+_SECTION_HEADER = re.compile(r'"?(' + '|'.join(map(re.escape, SECTION_NAMES)) + r')"?\s*:')
+# The value after the final heading is finished once a JSON string closes and is
+# followed by "," or "}", or once a plain-text line ends.
+_JSON_VALUE_END = re.compile(r'\s*"(?:[^"\\]|\\.)*"\s*[,}]')
+_TEXT_VALUE_END = re.compile(r'\s*[^"\s][^\n]*\n')
+# Headings can be split across streamed tokens, so rescan a little behind the new text.
+_HEADER_OVERLAP = max(len(name) for name in SECTION_NAMES) + 4
+
+
+class IncrementalSummaryParser:
+    """Watches a streamed model response for the end of the four summary sections.
+
+    Feed each token with `feed()`; it returns True as soon as all four
+    headings have appeared and the value of the last one is complete, at
+    which point the rest of the response can be dropped.
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._text = ''
+        self._scanned = 0
+        self._seen = {}
+        self._end = None
+        self.complete = False
+
+    @property
+    def text(self):
+        if self._parts:
+            self._text += ''.join(self._parts)
+            self._parts = []
+        return self._text
+
+    @property
+    def output(self):
+        """The response so far, cut right after the last section once complete."""
+        text = self.text
+        return text[:self._end] if self.complete else text
+
+    def feed(self, chunk):
+        if self.complete or not chunk:
+            return self.complete
+        self._parts.append(chunk)
+        # Only rescan once a line or a value could have ended.
+        if '\n' not in chunk and '"' not in chunk and ',' not in chunk and '}' not in chunk:
+            return False
+        text = self.text
+        for match in _SECTION_HEADER.finditer(text, max(0, self._scanned - _HEADER_OVERLAP)):
+            self._seen.setdefault(match.group(1), match.end())
+        self._scanned = len(text)
+        if len(self._seen) == len(SECTION_NAMES):
+            last_value = max(self._seen.values())
+            end = _JSON_VALUE_END.match(text, last_value) or _TEXT_VALUE_END.match(text, last_value)
+            if end:
+                self._end = end.end()
+                self.complete = True
+        return self.complete
+
+
+MISSING_SECTION = "Bilgi bulunamadı."
+# What a section still marked missing reads once the model produced any output.
+UNSPECIFIED_SECTION = "Özet metninde bu bölüm için spesifik bilgi bulunamadı."
+FULL_TEXT_KEY = "Tam Ozet Metni"
+
+_JSON_DECODER = json.JSONDecoder()
+_CODE_FENCE = re.compile(r'```(?:json)?[^\S\n]*\n?')
+# A section label anywhere on a line ("Dava Konusu: ...").
+_SECTION_LABEL = re.compile('(?:' + '|'.join(map(re.escape, SECTION_NAMES)) + '):')
+
+
+def _clean_lines(output):
+    if '\n' not in output:
+        return [output] if output.strip() else []
+    lines = []
+    for line in output.split('\n'):
+        if line.strip() and (not lines or line != lines[-1]):
+            lines.append(line)
+    return lines
+
+
+def clean_output(output):
+    """Drop blank lines and lines repeating the one before."""
+    return '\n'.join(_clean_lines(output))
+
+
+def _parse_json(output):
+    """Sections from a JSON answer, allowing code fences, text around the object
+    and a response cut off after its last value; None if there is no such object."""
+    start = output.find('{')
+    if start < 0:
+        return None
+    if '`' in output:
+        output, start = _CODE_FENCE.sub('', output[start:]), 0
+    # The streaming early stop cuts the answer right after the last value's comma.
+    tail = output.rstrip()
+    if tail.endswith(','):
+        output, start = tail[start:-1] + '}', 0
+    try:
+        data = _JSON_DECODER.raw_decode(output, start)[0]
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    sections = {}
+    for name in SECTION_NAMES:
+        value = data.get(name)
+        if isinstance(value, str):
+            sections[name] = value.strip()
+        elif value is not None:
+            sections[name] = json.dumps(value, ensure_ascii=False)
+    return sections or None
+
+
+def _parse_text(lines):
+    """Sections from "name: value" lines. A line with a section label starts a
+    section keyed by the text before its first colon; the lines after it, up
+    to the next such line, continue it."""
+    sections = {}
+    current = None
+    search = _SECTION_LABEL.search
+    for line in lines:
+        line = line.strip()
+        if search(line):
+            key, _, value = line.partition(':')
+            current = key.strip()
+            sections[current] = value.strip()
+        elif current is not None:
+            sections[current] += " " + line
+    return sections
+
+
+def _finish(parsed, output):
+    parsed['Output'] = output
+    if output:
+        for key, value in parsed.items():
+            if value.strip() == MISSING_SECTION:
+                parsed[key] = UNSPECIFIED_SECTION
+    parsed[FULL_TEXT_KEY] = "\n".join([f"{section}: {content}" for section, content in parsed.items()
+                                        if section != 'Output'])
+    return parsed
+
+
+def parse_summary(output):
+    """Turn a model answer into the summary dict stored for each file.
+
+    The dict has the four SECTION_NAMES, "Output" (the answer without blank
+    or repeated lines) and FULL_TEXT_KEY, all sections as "name: value"
+    lines. JSON answers are decoded directly; anything else is read as
+    "name: value" lines in one pass. A dict is taken as already parsed.
+    """
+    parsed = dict.fromkeys(SECTION_NAMES, MISSING_SECTION)
+    if isinstance(output, dict):
+        for name in SECTION_NAMES:
+            if name in output:
+                parsed[name] = output[name]
+        return _finish(parsed, output.get('Output', ''))
+    if not isinstance(output, str):
+        logger.error(f"Unexpected summary type: {type(output)}")
+        return _finish(parsed, str(output))
+    lines = _clean_lines(output)
+    output = '\n'.join(lines)
+    sections = _parse_json(output) if '{' in output else None
+    parsed.update(sections if sections is not None else _parse_text(lines))
+    return _finish(parsed, output)
+
+
+def parse_summaries(outputs):
+    """Parse many stored model answers at once, e.g. the "Output" of saved
+    summaries after the parser changes; returns the dicts in order."""
+    return [parse_summary(output) for output in outputs]
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import time
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of a stage's input; one is sent per downstream worker.
+_STOP = object()
+
+
+class Stage:
+    """One step of the pipeline.
+
+    `handler` is an async callable that receives an item and returns the item
+    to pass downstream, or None to drop it. Exceptions are logged and counted,
+    and the item is dropped, so a single bad file never stops the job.
+    """
+
+    def __init__(self, name, handler, workers=1):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+
+async def _feed(source, out_q, consumers):
+    async for item in source:
+        await out_q.put(item)
+    for _ in range(consumers):
+        await out_q.put(_STOP)
+
+
+async def _work(stage, in_q, out_q, on_done):
+    while True:
+        item = await in_q.get()
+        if item is _STOP:
+            return
+        started = time.perf_counter()
+        try:
+            result = await stage.handler(item)
+        except Exception as e:
+            metrics.observe(f"stage:{stage.name}", time.perf_counter() - started)
+            stage.failed += 1
+            logger.error(f"Stage '{stage.name}' failed: {str(e)}")
+            await _finish(stage, on_done, item, False)
+            continue
+        metrics.observe(f"stage:{stage.name}", time.perf_counter() - started)
+        if result is None:
+            stage.dropped += 1
+            await _finish(stage, on_done, item, True)
+            continue
+        stage.processed += 1
+        if out_q is not None:
+            await out_q.put(result)
+        else:
+            await _finish(stage, on_done, result, True)
+
+
+async def _finish(stage, on_done, item, ok):
+    if on_done is None:
+        return
+    try:
+        await on_done(item, ok)
+    except Exception as e:
+        # Logged like a handler error; raised, it would cancel every stage
+        # and fail the whole job over one item's bookkeeping.
+        logger.error(f"Finishing an item after stage '{stage.name}' failed: {str(e)}")
+
+
+async def _run_stage(stage, in_q, out_q, downstream_workers, on_done):
+    async with asyncio.TaskGroup() as tg:
+        for _ in range(stage.workers):
+            tg.create_task(_work(stage, in_q, out_q, on_done))
+    for _ in range(downstream_workers):
+        await out_q.put(_STOP)
+
+
+async def run_pipeline(source, stages, queue_size=32, on_done=None):
+    """Drive items from the async iterator `source` through `stages`.
+
+    Stages are joined by bounded queues, so a slow stage applies backpressure
+    all the way up to the source and at most `queue_size` items wait between
+    any two stages. `on_done(item, ok)` is awaited once for every item that
+    leaves the pipeline, whether it completed, was dropped (ok=True) or
+    failed (ok=False); its exceptions are logged, not raised. Returns
+    per-stage counters.
+    """
+    queues = [asyncio.Queue(maxsize=queue_size) for _ in stages]
+    async with asyncio.TaskGroup() as tg:
+        tg.create_task(_feed(source, queues[0], stages[0].workers))
+        for i, stage in enumerate(stages):
+            last = i + 1 == len(stages)
+            out_q = None if last else queues[i + 1]
+            downstream_workers = 0 if last else stages[i + 1].workers
+            tg.create_task(_run_stage(stage, queues[i], out_q, downstream_workers, on_done))
+    return {stage.name: stage.stats() for stage in stages}
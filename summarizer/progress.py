@@ -0,0 +1,112 @@
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+RESULTS_KEY_PREFIX = 'summarization_results'
+PROGRESS_KEY_PREFIX = 'job_progress'
+# Seconds between progress writes; results are buffered in between.
+PROGRESS_INTERVAL = float(os.getenv('PROGRESS_INTERVAL', 1))
+# Results are also flushed as soon as this many are buffered.
+RESULTS_BATCH_SIZE = 100
+RESULTS_TTL = 7 * 24 * 3600
+
+
+def results_key(job_id):
+    return f"{RESULTS_KEY_PREFIX}:{job_id}"
+
+
+def progress_key(job_id):
+    return f"{PROGRESS_KEY_PREFIX}:{job_id}"
+
+
+def _decode(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+async def set_total(redis_client, job_id, total):
+    """Record how many files the job will go through, for the ETA."""
+    await redis_client.hset(progress_key(job_id), 'total', total)
+
+
+def read_progress(data):
+    """Turn a raw progress hash into the dict served to clients."""
+    data = {_decode(k): _decode(v) for k, v in data.items()}
+    progress = {field: int(data.get(field, 0)) for field in ('total', 'listed', 'skipped', 'summarized', 'failed')}
+    progress['done'] = progress['skipped'] + progress['summarized'] + progress['failed']
+    progress['started_at'] = float(data['started_at']) if 'started_at' in data else None
+    progress['updated_at'] = float(data['updated_at']) if 'updated_at' in data else None
+    progress['eta_seconds'] = float(data['eta_seconds']) if 'eta_seconds' in data else None
+    return progress
+
+
+class JobProgress:
+    """Per-job results stream and progress hash in Redis.
+
+    Every summarized file is appended to the `summarization_results:{job_id}`
+    stream, which clients page through by entry id. Counters for listed,
+    skipped, summarized and failed files, plus an ETA, live in the
+    `job_progress:{job_id}` hash. Shards of one job share both keys. Writes
+    are buffered and sent in one pipeline every PROGRESS_INTERVAL seconds.
+    """
+
+    def __init__(self, redis_client, job_id, interval=None):
+        self.redis = redis_client
+        self.job_id = job_id
+        self.interval = interval or PROGRESS_INTERVAL
+        self._counts = {}
+        self._results = []
+        self._last_flush = time.monotonic()
+
+    async def start(self):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hsetnx(progress_key(self.job_id), 'started_at', time.time())
+            pipe.expire(progress_key(self.job_id), RESULTS_TTL)
+            await pipe.execute()
+        return self
+
+    async def reduce_total(self, count):
+        """Take files the listing did not find after all off the job's total."""
+        await self.redis.hincrby(progress_key(self.job_id), 'total', -count)
+
+    async def listed(self):
+        await self._count('listed')
+
+    async def finished(self, outcome):
+        await self._count(outcome)
+
+    async def add_result(self, file_key, summary_key, summary):
+        self._results.append({"file_key": file_key, "summary_key": summary_key,
+                              "summary": json.dumps(summary, ensure_ascii=False)})
+        if len(self._results) >= RESULTS_BATCH_SIZE:
+            await self.flush()
+
+    async def _count(self, field):
+        self._counts[field] = self._counts.get(field, 0) + 1
+        if time.monotonic() - self._last_flush >= self.interval:
+            await self.flush()
+
+    async def flush(self):
+        self._last_flush = time.monotonic()
+        counts, self._counts = self._counts, {}
+        results, self._results = self._results, []
+        key = progress_key(self.job_id)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for result in results:
+                pipe.xadd(results_key(self.job_id), result)
+            if results:
+                pipe.expire(results_key(self.job_id), RESULTS_TTL)
+            for field, count in counts.items():
+                pipe.hincrby(key, field, count)
+            pipe.hgetall(key)
+            progress = read_progress((await pipe.execute())[-1])
+
+        now = time.time()
+        update = {"updated_at": now}
+        elapsed = now - progress['started_at'] if progress['started_at'] else 0
+        if progress['done'] and elapsed > 0 and progress['total']:
+            rate = progress['done'] / elapsed
+            update["eta_seconds"] = max(0, progress['total'] - progress['done']) / rate
+        await self.redis.hset(key, mapping=update)
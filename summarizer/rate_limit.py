@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Caps the request rate at `rate` per second, allowing bursts of `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Waiters queue on the lock, so tokens are handed out in arrival order.
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AIMDLimiter:
+    """Adaptive cap on in-flight requests (additive increase, multiplicative decrease).
+
+    Every fast, successful response raises the limit by roughly one request
+    per round trip. Slow responses, server errors and throttling shrink it
+    multiplicatively. A throttle also pauses all new requests until its
+    `Retry-After` has passed.
+    """
+
+    def __init__(self, initial, minimum, maximum, target_latency, backoff=0.5):
+        self.minimum = max(1, int(minimum))
+        self.maximum = max(self.minimum, int(maximum))
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.target_latency = float(target_latency)
+        self.backoff = backoff
+        self.in_flight = 0
+        self.throttled = 0
+        self.errors = 0
+        self.successes = 0
+        self._resume_at = 0.0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            while True:
+                delay = self._resume_at - time.monotonic()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                await self._cond.wait()
+
+    async def release(self, latency=None, error=False, throttled=False, retry_after=None, cancelled=False):
+        """Return a slot. Cancelled requests say nothing about the API's load,
+        so they leave the limit where it is."""
+        async with self._cond:
+            self.in_flight -= 1
+            if cancelled:
+                pass
+            elif throttled:
+                self.throttled += 1
+                self._decrease(self.backoff)
+                self._resume_at = max(self._resume_at, time.monotonic() + (retry_after or 1.0))
+                logger.warning(f"LLM API throttled; concurrency limit now {int(self.limit)}, "
+                               f"pausing {retry_after or 1.0:.1f}s")
+            elif error:
+                self.errors += 1
+                self._decrease(self.backoff)
+            elif latency is not None and latency > self.target_latency:
+                self.successes += 1
+                self._decrease(0.9)
+            else:
+                self.successes += 1
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+    def _decrease(self, factor):
+        self.limit = max(float(self.minimum), self.limit * factor)
+
+    def stats(self):
+        return {
+            "concurrency_limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "successes": self.successes,
+            "errors": self.errors,
+            "throttled": self.throttled,
+        }
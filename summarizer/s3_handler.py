@@ -1,70 +1,163 @@
 import aiobotocore.session
+from aiobotocore.config import AioConfig
 import asyncio
 import logging
 import json
 import os
+import time
+from contextlib import AsyncExitStack, aclosing, asynccontextmanager
+from . import metrics
 
 logger = logging.getLogger(__name__)
 
-async def get_last_processed_file(bucket, prefix):
+S3_REGION = os.getenv('S3_REGION', os.getenv('AWS_REGION', 'eu-north-1'))
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL') or None
+S3_MAX_POOL_CONNECTIONS = int(os.getenv('S3_MAX_POOL_CONNECTIONS', 50))
+
+# Summaries are written under this prefix, mirroring the source key.
+SUMMARY_PREFIX = 'summaries/'
+
+# The manager currently open in this process, shared by every handler below.
+_active_manager = None
+
+
+class S3ClientManager:
+    """Long-lived S3 client shared by all handler functions.
+
+    Open it once for the lifetime of the worker:
+
+        async with S3ClientManager(max_pool_connections=32):
+            ...
+
+    While it is open, every function in this module reuses its client and
+    connection pool instead of creating a new session per call. Point
+    `endpoint_url` at a local S3-compatible server for testing.
+    """
+
+    def __init__(self, region_name=None, endpoint_url=None, max_pool_connections=None):
+        self.region_name = region_name or S3_REGION
+        self.endpoint_url = endpoint_url or S3_ENDPOINT_URL
+        self.max_pool_connections = max_pool_connections or S3_MAX_POOL_CONNECTIONS
+        self.client = None
+        self._exit_stack = None
+
+    async def __aenter__(self):
+        global _active_manager
+        self._exit_stack = AsyncExitStack()
+        self.client = await self._exit_stack.enter_async_context(_create_client(
+            self.region_name, self.endpoint_url, self.max_pool_connections))
+        _active_manager = self
+        logger.info(f"S3 client opened (region={self.region_name}, endpoint={self.endpoint_url}, "
+                    f"pool={self.max_pool_connections})")
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        global _active_manager
+        if _active_manager is self:
+            _active_manager = None
+        await self._exit_stack.aclose()
+        self.client = None
+        logger.info("S3 client closed")
+
+
+def _create_client(region_name, endpoint_url, max_pool_connections):
     session = aiobotocore.session.get_session()
-    async with session.create_client('s3', region_name='eu-north-1') as client:
+    return session.create_client(
+        's3',
+        region_name=region_name,
+        endpoint_url=endpoint_url,
+        config=AioConfig(max_pool_connections=max_pool_connections),
+    )
+
+
+@asynccontextmanager
+async def s3_client():
+    """Yield the shared client, or a short-lived one when no manager is open."""
+    if _active_manager is not None:
+        yield _active_manager.client
+        return
+    async with _create_client(S3_REGION, S3_ENDPOINT_URL, S3_MAX_POOL_CONNECTIONS) as client:
+        yield client
+
+async def list_objects(bucket, prefix, start_after=None, end_key=None):
+    """Yield the listing entry (Key, LastModified, ETag, Size) of every object
+    under `prefix` in key order, restricted to the range (start_after, end_key].
+    """
+    params = {'Bucket': bucket, 'Prefix': prefix}
+    if start_after:
+        params['StartAfter'] = start_after
+    async with s3_client() as client:
         paginator = client.get_paginator('list_objects_v2')
-        last_key = None
-        async for result in paginator.paginate(Bucket=bucket, Prefix=f"{prefix}summarizer/"):
-            for content in sorted(result.get('Contents', []), key=lambda x: x['LastModified'], reverse=True):
-                last_key = content['Key']
-                return last_key
-    return None
-
-async def get_s3_files(bucket, prefix, max_files):
+        requested = time.perf_counter()
+        async for result in paginator.paginate(**params):
+            metrics.observe('s3:list', time.perf_counter() - requested)
+            logger.debug("Received a page of results with %d items", len(result.get('Contents', [])))
+            for content in result.get('Contents', []):
+                if end_key is not None and content['Key'] > end_key:
+                    logger.info(f"Reached end of key range: {end_key}")
+                    return
+                if content['Key'].endswith('/'):  # Skip directories
+                    logger.debug("Skipping directory: %s", content['Key'])
+                    continue
+                if content['Key'] == '9/b+V+I9J23s3P2ZRZ9TX6XNE3RP301xQ7VtHBvU':
+                    logger.info(f"Skipping specific file: {content['Key']}")
+                    continue
+                yield content
+            requested = time.perf_counter()
+
+async def get_s3_files(bucket, prefix, max_files, start_after=None, end_key=None):
+    """Yield up to `max_files` object keys under `prefix` in key order.
+
+    `start_after` and `end_key` restrict the listing to the key range
+    (start_after, end_key], which is how a job is split into shards.
+    Listing errors are raised, so a failed LIST is never mistaken for the
+    end of the prefix.
+    """
     logger.info(f"Starting to list files in bucket: {bucket}, prefix: {prefix}")
-    session = aiobotocore.session.get_session()
-    async with session.create_client('s3', region_name='eu-north-1') as client:
-        paginator = client.get_paginator('list_objects_v2')
-        file_count = 0
-        try:
-            async for result in paginator.paginate(Bucket=bucket, Prefix=prefix):
-                logger.info(f"Received a page of results with {len(result.get('Contents', []))} items")
-                for content in result.get('Contents', []):
-                    if content['Key'].endswith('/'):  # Skip directories
-                        logger.info(f"Skipping directory: {content['Key']}")
-                        continue
-                    if content['Key'] == '9/b+V+I9J23s3P2ZRZ9TX6XNE3RP301xQ7VtHBvU':
-                        logger.info(f"Skipping specific file: {content['Key']}")
-                        continue
-                    logger.info(f"Yielding file: {content['Key']}")
-                    yield content['Key']
-                    file_count += 1
-                    if max_files and file_count >= max_files:
-                        logger.info(f"Reached max_files limit of {max_files}")
-                        return
-        except Exception as e:
-            logger.error(f"Error listing S3 files: {str(e)}")
+    file_count = 0
+    try:
+        async with aclosing(list_objects(bucket, prefix, start_after, end_key)) as objects:
+            async for content in objects:
+                logger.debug("Yielding file: %s", content['Key'], extra={'file_key': content['Key']})
+                yield content['Key']
+                file_count += 1
+                if max_files and file_count >= max_files:
+                    logger.info(f"Reached max_files limit of {max_files}")
+                    return
+    except Exception as e:
+        logger.error(f"Error listing S3 files after {file_count} files: {str(e)}")
+        raise
     logger.info(f"Finished listing files. Total files found: {file_count}")
 
+async def list_keys(bucket, prefix):
+    """Yield every key under `prefix`, one LIST page at a time."""
+    async with s3_client() as client:
+        paginator = client.get_paginator('list_objects_v2')
+        async for result in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for content in result.get('Contents', []):
+                yield content['Key']
+
 async def get_file_content(bucket, key):
-    logger.info(f"Fetching content for file: {key}")
-    session = aiobotocore.session.get_session()
-    async with session.create_client('s3', region_name='eu-north-1') as client:
+    logger.debug("Fetching content for file: %s", key, extra={'file_key': key})
+    async with s3_client() as client:
         try:
-            response = await client.get_object(Bucket=bucket, Key=key)
-            async with response['Body'] as stream:
-                content = await stream.read()
-            logger.info(f"Successfully fetched content for file: {key}")
+            with metrics.timed('s3:get'):
+                response = await client.get_object(Bucket=bucket, Key=key)
+                async with response['Body'] as stream:
+                    content = await stream.read()
+            logger.debug("Successfully fetched content for file: %s", key, extra={'file_key': key})
             return content
         except client.exceptions.NoSuchKey:
-            logger.info(f"File not found: {key}")
+            logger.info("File not found: %s", key, extra={'file_key': key})
             return None
         except Exception as e:
             logger.error(f"Error fetching content for file {key}: {str(e)}")
             raise
 
 async def check_summary_exists(bucket, key):
-    session = aiobotocore.session.get_session()  # Use get_session to create a session
-    async with session.create_client('s3', region_name='eu-north-1') as client:  # Set the correct region here
+    async with s3_client() as client:
         try:
-            await client.head_object(Bucket=bucket, Key=f"summaries/{key}")
+            await client.head_object(Bucket=bucket, Key=f"{SUMMARY_PREFIX}{key}")
             return True
         except client.exceptions.ClientError as e:
             if e.response['Error']['Code'] == '404':
@@ -78,14 +171,24 @@ async def check_summary_exists(bucket, key):
             return False
 
 async def upload_summary_to_s3(bucket, key, summary):
-    session = aiobotocore.session.get_session()  # Use get_session to create a session
-    async with session.create_client('s3', region_name='eu-north-1') as client:  # Set the correct region here
+    async with s3_client() as client:
         try:
-            summary_key = f"summaries/{key}"
-            await client.put_object(Bucket=bucket, Key=summary_key, Body=str(summary).encode('utf-8'))
-            logger.info(f"Successfully uploaded summary to {summary_key}")
+            summary_key = f"{SUMMARY_PREFIX}{key}"
+            with metrics.timed('s3:put'):
+                await client.put_object(Bucket=bucket, Key=summary_key, Body=str(summary).encode('utf-8'))
+            logger.debug("Successfully uploaded summary to %s", summary_key, extra={'file_key': key})
         except Exception as e:
             logger.error(f"Error uploading summary to S3: {str(e)}")
+            raise
+
+async def put_object(bucket, key, body):
+    async with s3_client() as client:
+        try:
+            await client.put_object(Bucket=bucket, Key=key, Body=body)
+            logger.info(f"Successfully uploaded {key} ({len(body)} bytes)")
+        except Exception as e:
+            logger.error(f"Error uploading {key} to S3: {str(e)}")
+            raise
 
 # Example usage
 async def main():
@@ -93,9 +196,10 @@ async def main():
     prefix = ''
     max_files = 5
 
-    async for key in get_s3_files(bucket, prefix, max_files):
-        content = await get_file_content(bucket, key)
-        logger.info(f"Successfully retrieved content for {key} (length: {len(content)})")
+    async with S3ClientManager():
+        async for key in get_s3_files(bucket, prefix, max_files):
+            content = await get_file_content(bucket, key)
+            logger.info(f"Successfully retrieved content for {key} (length: {len(content)})")
 
 if __name__ == "__main__":
     asyncio.run(main())
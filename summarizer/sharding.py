@@ -0,0 +1,174 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import aclosing
+from .s3_handler import list_objects
+from .progress import progress_key
+from . import fair_queue
+
+logger = logging.getLogger(__name__)
+
+SHARD_LEASES = 'shard_leases'
+SHARD_KEY_PREFIX = 'shard'
+JOB_SHARDS_KEY_PREFIX = 'job_shards'
+# Jobs larger than this many files are split into shards of this size.
+SHARD_SIZE = int(os.getenv('SHARD_SIZE', 500))
+# A shard whose lease is not renewed within this many seconds goes back to the queue.
+SHARD_LEASE_TTL = int(os.getenv('SHARD_LEASE_TTL', 120))
+SHARD_TTL = 7 * 24 * 3600
+
+# Record a shard's outcome against its parent. Deleting the shard record doubles
+# as a guard: if a reaped shard was also run elsewhere, only the first finisher counts.
+# Returns -1 for a duplicate, 1 when this was the parent's last shard, else 0.
+_COMPLETE_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+if redis.call('DEL', KEYS[2]) == 0 then
+    return -1
+end
+if ARGV[2] == '1' then
+    redis.call('HINCRBY', KEYS[3], 'failed', 1)
+else
+    redis.call('HINCRBY', KEYS[3], 'summarized_files', ARGV[3])
+    redis.call('HINCRBY', KEYS[3], 'skipped_files', ARGV[4])
+end
+local finished = redis.call('HINCRBY', KEYS[3], 'finished', 1)
+if finished >= tonumber(redis.call('HGET', KEYS[3], 'total')) then
+    return 1
+end
+return 0
+"""
+
+
+def shard_key(shard_id):
+    return f"{SHARD_KEY_PREFIX}:{shard_id}"
+
+
+def job_shards_key(job_id):
+    return f"{JOB_SHARDS_KEY_PREFIX}:{job_id}"
+
+
+def _decode(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+async def split_job(redis_client, job):
+    """Split `job` into key-range shards and enqueue them; returns the shard count.
+
+    The job's first `max_files` keys are listed once and cut into ranges of
+    SHARD_SIZE keys. Each shard gets exactly the keys in its range as its
+    `max_files`, so the job's budget is divided up front and the shards can
+    never exceed it together, even if one is retried. A failed LIST raises
+    rather than leaving part of the key range without a shard.
+    """
+    job_id = job['id']
+    shards = []
+    start_after, count, last_key = None, 0, None
+    max_files, listed = job.get('max_files', 100), 0
+    async with aclosing(list_objects(job['bucket_name'], job.get('prefix', ''))) as objects:
+        async for entry in objects:
+            count += 1
+            listed += 1
+            last_key = entry['Key']
+            if count == SHARD_SIZE:
+                shards.append((start_after, last_key, count))
+                start_after, count = last_key, 0
+            if listed >= max_files:
+                break
+    if count:
+        shards.append((start_after, last_key, count))
+
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.hset(job_shards_key(job_id), mapping={"total": len(shards), "finished": 0, "failed": 0,
+                                                   "summarized_files": 0, "skipped_files": 0})
+        pipe.expire(job_shards_key(job_id), SHARD_TTL)
+        pipe.hset(progress_key(job_id), 'total', sum(count for _, _, count in shards))
+        for n, (start_after, end_key, count) in enumerate(shards):
+            shard_id = f"{job_id}:{n}"
+            shard = {
+                "id": shard_id,
+                "job_id": job_id,
+                "bucket_name": job['bucket_name'],
+                "prefix": job.get('prefix', ''),
+                "start_after": start_after,
+                "end_key": end_key,
+                "max_files": count,
+                "bypass_cache": job.get('bypass_cache', False),
+                "sink": job.get('sink'),
+                "fingerprint": job.get('fingerprint'),
+                "tenant": fair_queue.job_tenant(job),
+                "priority": fair_queue.job_priority(job),
+            }
+            pipe.set(shard_key(shard_id), json.dumps(shard), ex=SHARD_TTL)
+            fair_queue.push(pipe, shard_id, shard)
+        await pipe.execute()
+    logger.info(f"Split job {job_id} into {len(shards)} shards")
+    return len(shards)
+
+
+async def load_shard(redis_client, shard_id):
+    """Return the record of a claimed shard, or None if it has already finished."""
+    shard_data = await redis_client.get(shard_key(_decode(shard_id)))
+    if shard_data is None:
+        await redis_client.zrem(SHARD_LEASES, shard_id)
+        return None
+    return json.loads(shard_data)
+
+
+async def heartbeat(redis_client, shard_id, interval=None):
+    """Renew the lease on `shard_id` until cancelled."""
+    interval = interval or SHARD_LEASE_TTL / 3
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await redis_client.zadd(SHARD_LEASES, {shard_id: time.time() + SHARD_LEASE_TTL}, xx=True)
+        except Exception as e:
+            # Keep trying; the lease only lapses if renewals fail for a whole TTL.
+            logger.warning(f"Error renewing lease on shard {shard_id}: {str(e)}")
+
+
+async def requeue_shard(redis_client, shard):
+    """Give the lease back and put the shard at the head of the queue."""
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.set(shard_key(shard['id']), json.dumps(shard), ex=SHARD_TTL)
+        pipe.zrem(SHARD_LEASES, shard['id'])
+        fair_queue.push(pipe, shard['id'], shard, head=True)
+        await pipe.execute()
+
+
+async def complete_shard(redis_client, shard, result=None):
+    """Record a finished (or, with no `result`, failed) shard against its parent job.
+
+    Returns the parent's aggregated counters once its last shard has finished,
+    otherwise None. The update runs as one script, so exactly one caller sees
+    the final count.
+    """
+    key = job_shards_key(shard['job_id'])
+    failed = result is None
+    status = await redis_client.eval(
+        _COMPLETE_SCRIPT, 3, SHARD_LEASES, shard_key(shard['id']), key, shard['id'], '1' if failed else '0',
+        0 if failed else result['summarized_files'], 0 if failed else result['skipped_files'])
+    if status != 1:
+        return None
+    return {_decode(k): int(v) for k, v in (await redis_client.hgetall(key)).items()}
+
+
+async def reap_expired_leases(redis_client):
+    """Move every shard whose lease has expired back onto its queue."""
+    reaped = 0
+    for shard_id in await redis_client.zrangebyscore(SHARD_LEASES, '-inf', time.time()):
+        # Only the worker whose ZREM succeeds requeues, so concurrent reapers
+        # cannot queue a shard twice.
+        if not await redis_client.zrem(SHARD_LEASES, shard_id):
+            continue
+        shard_data = await redis_client.get(shard_key(_decode(shard_id)))
+        if shard_data is None:
+            continue
+        async with redis_client.pipeline(transaction=True) as pipe:
+            fair_queue.push(pipe, shard_id, json.loads(shard_data))
+            await pipe.execute()
+        reaped += 1
+    if reaped:
+        logger.warning(f"Requeued {reaped} shards with expired leases")
+    return reaped
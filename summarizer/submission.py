@@ -0,0 +1,131 @@
+import hashlib
+import json
+import logging
+import uuid
+from . import fair_queue
+
+logger = logging.getLogger(__name__)
+
+JOB_KEY_PREFIX = 'job'
+# Written by the worker as a job runs; submission records the job as queued.
+JOB_STATUS_KEY = 'job_status'
+QUEUED_STATUS = json.dumps({"status": "queued"})
+DEDUPE_KEY_PREFIX = 'job_dedupe'
+IDEMPOTENCY_KEY_PREFIX = 'job_idempotency'
+JOB_TTL = 3600
+# Upper bound on how long a job blocks identical submissions if its worker
+# never gets to release it.
+DEDUPE_TTL = 6 * 3600
+IDEMPOTENCY_TTL = 24 * 3600
+SINKS = ('object', 'parquet')
+
+# Enqueue a batch of jobs atomically. For each job: reuse the job id already
+# stored under its idempotency key or its fingerprint, or else claim both keys,
+# push the job onto its tenant's queue, store it and mark it queued. ARGV
+# starts with the three TTLs, the wakeup list's length and the queued status,
+# then eight values per job. Returns a job id and a status per job.
+_SUBMIT_SCRIPT = """
+local results = {}
+for i = 6, #ARGV, 8 do
+    local job_id, job, job_key, dedupe_key, idempotency_key = ARGV[i], ARGV[i + 1], ARGV[i + 2], ARGV[i + 3], ARGV[i + 4]
+    local queue_key, tenants_key, tenant = ARGV[i + 5], ARGV[i + 6], ARGV[i + 7]
+    local existing, status = false, 'enqueued'
+    if idempotency_key ~= '' then
+        existing, status = redis.call('GET', idempotency_key), 'replayed'
+    end
+    if not existing then
+        existing, status = redis.call('GET', dedupe_key), 'duplicate'
+    end
+    if existing then
+        table.insert(results, existing)
+        table.insert(results, status)
+    else
+        redis.call('SET', dedupe_key, job_id, 'EX', ARGV[1])
+        if idempotency_key ~= '' then
+            redis.call('SET', idempotency_key, job_id, 'EX', ARGV[2])
+        end
+        redis.call('RPUSH', queue_key, job)
+        redis.call('ZADD', tenants_key, 'NX', 0, tenant)
+        redis.call('RPUSH', KEYS[1], 1)
+        redis.call('LTRIM', KEYS[1], 0, ARGV[4] - 1)
+        redis.call('SET', job_key, job, 'EX', ARGV[3])
+        redis.call('HSET', KEYS[2], job_id, ARGV[5])
+        table.insert(results, job_id)
+        table.insert(results, 'enqueued')
+    end
+end
+return results
+"""
+
+# Delete a dedupe key only if it still points at the finishing job.
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def build_job(data):
+    """Validate one job request and return the job dict; raises ValueError."""
+    if not isinstance(data, dict) or not data.get('bucket_name'):
+        raise ValueError("Missing 'bucket_name' in request")
+    sink = data.get('sink')
+    if sink not in (None, *SINKS):
+        raise ValueError("'sink' must be 'object' or 'parquet'")
+    priority = data.get('priority')
+    if priority not in (None, *fair_queue.PRIORITIES):
+        raise ValueError("'priority' must be 'high', 'normal' or 'low'")
+    job = {
+        'id': str(uuid.uuid4()),
+        'bucket_name': data['bucket_name'],
+        'prefix': data.get('prefix', ''),
+        'max_files': int(data.get('max_files', 100)),
+        'bypass_cache': bool(data.get('bypass_cache', False)),
+        'incremental': bool(data.get('incremental', False)),
+        'sink': sink,
+        'tenant': str(data.get('tenant') or data['bucket_name'])
+    }
+    job['priority'] = priority or fair_queue.job_priority(job)
+    job['fingerprint'] = job_fingerprint(job)
+    return job
+
+
+def job_fingerprint(job):
+    """Identify jobs that would do the same work: same bucket, prefix and options."""
+    options = {key: value for key, value in job.items() if key not in ('id', 'fingerprint', 'priority')}
+    return hashlib.sha256(json.dumps(options, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def job_key(job_id):
+    return f"{JOB_KEY_PREFIX}:{job_id}"
+
+
+def dedupe_key(fingerprint):
+    return f"{DEDUPE_KEY_PREFIX}:{fingerprint}"
+
+
+def submit_jobs(redis_client, jobs, idempotency_keys=None):
+    """Enqueue `jobs` in one atomic round trip (sync client).
+
+    A job identical to one still queued or running is collapsed onto that
+    job's id, and a job whose idempotency key was seen in the last day gets
+    the id it was given then. Returns (job_id, status) per job, where status
+    is 'enqueued', 'duplicate' or 'replayed'.
+    """
+    idempotency_keys = idempotency_keys or [None] * len(jobs)
+    args = [DEDUPE_TTL, IDEMPOTENCY_TTL, JOB_TTL, fair_queue.WAKEUP_MAX, QUEUED_STATUS]
+    for job, idempotency_key in zip(jobs, idempotency_keys):
+        priority, tenant = fair_queue.job_priority(job), fair_queue.job_tenant(job)
+        args += [job['id'], json.dumps(job), job_key(job['id']), dedupe_key(job['fingerprint']),
+                 f"{IDEMPOTENCY_KEY_PREFIX}:{idempotency_key}" if idempotency_key else '',
+                 fair_queue.queue_key(priority, tenant), fair_queue.tenants_key(priority), tenant]
+    results = redis_client.eval(_SUBMIT_SCRIPT, 2, fair_queue.WAKEUP_KEY, JOB_STATUS_KEY, *args)
+    results = [value.decode('utf-8') if isinstance(value, bytes) else value for value in results]
+    return list(zip(results[::2], results[1::2]))
+
+
+async def release_dedupe(redis_client, job):
+    """Let identical jobs be submitted again once `job` has finished."""
+    if job.get('fingerprint'):
+        await redis_client.eval(_RELEASE_SCRIPT, 1, dedupe_key(job['fingerprint']), job.get('job_id', job['id']))
@@ -0,0 +1,82 @@
+import logging
+from .s3_handler import SUMMARY_PREFIX, list_keys
+
+logger = logging.getLogger(__name__)
+
+INDEX_KEY = 'summary_index'
+# Sets are written in batches so seeding a large prefix stays a few round trips.
+SEED_BATCH_SIZE = 1000
+
+
+class SummaryIndex:
+    """Summary keys that already exist for a bucket/prefix.
+
+    `load()` lists `summaries/{prefix}` once with the paginator and keeps the
+    keys in memory. When a Redis client is given, the keys are also kept in
+    the `summary_index:{bucket}` set, and later jobs under a loaded prefix
+    skip the listing and ask that set with SMISMEMBER about the keys they
+    actually list, so loading costs nothing however large the bucket is.
+    `add()` keeps both copies current as summaries are uploaded.
+    """
+
+    def __init__(self, bucket, prefix, redis_client=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.redis = redis_client
+        self.keys = set()
+        self.in_redis = False
+
+    @property
+    def redis_key(self):
+        return f"{INDEX_KEY}:{self.bucket}"
+
+    @property
+    def loaded_key(self):
+        return f"{INDEX_KEY}:{self.bucket}:loaded"
+
+    async def contains(self, summary_keys):
+        """Whether each of `summary_keys` has a summary, as a list of bools."""
+        if not summary_keys:
+            return []
+        if self.in_redis:
+            return [bool(found) for found in await self.redis.smismember(self.redis_key, summary_keys)]
+        return [summary_key in self.keys for summary_key in summary_keys]
+
+    async def has(self, summary_key):
+        return (await self.contains([summary_key]))[0]
+
+    async def load(self):
+        if self.redis is not None and await self._loaded_in_redis():
+            self.in_redis = True
+            logger.info(f"Summary keys for {self.bucket}/{self.prefix} are indexed in Redis")
+            return self
+
+        batch = []
+        async for key in list_keys(self.bucket, f"{SUMMARY_PREFIX}{self.prefix}"):
+            summary_key = key[len(SUMMARY_PREFIX):]
+            self.keys.add(summary_key)
+            batch.append(summary_key)
+            if self.redis is not None and len(batch) >= SEED_BATCH_SIZE:
+                await self.redis.sadd(self.redis_key, *batch)
+                batch = []
+        if self.redis is not None:
+            if batch:
+                await self.redis.sadd(self.redis_key, *batch)
+            await self.redis.sadd(self.loaded_key, self.prefix)
+        logger.info(f"Listed {len(self.keys)} existing summaries under {self.bucket}/{SUMMARY_PREFIX}{self.prefix}")
+        return self
+
+    async def add(self, summary_key):
+        if not self.in_redis:
+            self.keys.add(summary_key)
+        if self.redis is not None:
+            await self.redis.sadd(self.redis_key, summary_key)
+
+    async def _loaded_in_redis(self):
+        # A prefix is covered if it, or any prefix above it, was fully listed before.
+        loaded = await self.redis.smembers(self.loaded_key)
+        for prefix in loaded:
+            prefix = prefix.decode('utf-8') if isinstance(prefix, bytes) else prefix
+            if self.prefix.startswith(prefix):
+                return True
+        return False
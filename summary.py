@@ -1,21 +1,14 @@
-import aiohttp
 import asyncio
 import os
-import ssl
 from dotenv import load_dotenv
 from summarizer.s3_handler import get_s3_files, get_file_content
+from summarizer.llm_client import LLMClient
 
 load_dotenv()
 
-TOGETHER_API_KEY = os.getenv('TOGETHER_API_KEY')
 MODEL = os.getenv('MODEL', 'togethercomputer/llama-2-70b-chat')
 
-# Create a custom SSL context that doesn't verify certificates
-ssl_context = ssl.create_default_context()
-ssl_context.check_hostname = False
-ssl_context.verify_mode = ssl.CERT_NONE
-
-async def summarize_text(text):
+async def summarize_text(text, llm=None):
     prompt = f"""Aşağıdaki metin bir Yargıtay kararıdır. Bu kararın özetini çıkarın ve kesinlikle aşağıdaki formatta sunun:
 
                 Dava Konusu: [Davanın ana konusu ve taraflar arasındaki uyuşmazlığın özü]
@@ -34,41 +27,37 @@ async def summarize_text(text):
                 {text}
 
                 Özet:"""
+    payload = {
+        "model": MODEL,
+        "prompt": prompt,
+        "max_tokens": 2000,
+        "temperature": 0.7,
+        "top_p": 0.95,
+        "top_k": 50,
+        "repetition_penalty": 1.1,
+        "stop": ["Summary:", "\n\n"]
+    }
     try:
-        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=ssl_context)) as session:
-            async with session.post(
-            "https://api.together.xyz/inference",
-            headers={
-                "Authorization": f"Bearer {TOGETHER_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": MODEL,
-                "prompt": prompt,
-                "max_tokens": 2000,
-                "temperature": 0.7,
-                "top_p": 0.95,
-                "top_k": 50,
-                "repetition_penalty": 1.1,
-                "stop": ["Summary:", "\n\n"]
-            }
-        ) as response:
-                result = await response.json()
-            return result['output']['choices'][0]['text'].strip()
+        if llm is None:
+            async with LLMClient() as llm:
+                result = await llm.complete(payload)
+        else:
+            result = await llm.complete(payload)
+        return result['output']['choices'][0]['text'].strip()
     except Exception as e:
         print(f"Error in summarize_text: {str(e)}")
         return None
 
-async def process_file(bucket_name, key, session):
+async def process_file(bucket_name, key, llm):
     content = await get_file_content(bucket_name, key)
-    summary = await summarize_text(content)
+    summary = await summarize_text(content, llm)
     return key, summary
 
 async def summarize_files_from_s3(bucket_name, prefix='', max_files=100):
-    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=ssl_context)) as session:
+    async with LLMClient() as llm:
         tasks = []
         async for key in get_s3_files(bucket_name, prefix, max_files):
-            tasks.append(process_file(bucket_name, key, session))
+            tasks.append(process_file(bucket_name, key, llm))
         results = await asyncio.gather(*tasks)
     return dict(results)
 
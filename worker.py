@@ -1,55 +1,280 @@
 import asyncio
-import redis
+import redis.asyncio
 import json
-import logging
+import multiprocessing
 import os
 import signal
-from summarizer.core import run_summarize_files_from_s3
+import time
+from summarizer.chunking import load_encoding
+from summarizer.core import run_summarize_files_from_s3, s3_pool_size
+from summarizer.sharding import (SHARD_LEASES, SHARD_LEASE_TTL, SHARD_SIZE, complete_shard, heartbeat, load_shard,
+                                 reap_expired_leases, requeue_shard, split_job)
+from summarizer.s3_handler import S3ClientManager
+from summarizer.progress import progress_key, set_total
+from summarizer.submission import release_dedupe
+from summarizer import fair_queue, metrics
+from summarizer.llm_client import LLMClient
 from dotenv import load_dotenv
+from logger import log_context, setup_logger, stop_logging
 
 load_dotenv()
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
+logger = setup_logger(__name__)
 
 redis_url = os.getenv('REDIS_URL', 'redis://localhost:6379')
-queue_name = 'default'
 job_status_key = 'job_status'
-current_job_id = None
 
-async def process_job(job):
-    global current_job_id
-    current_job_id = job['id']
+# Jobs run concurrently in each process, and processes forked per dyno.
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', 4))
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', 1))
+# Files in flight across all jobs of one process.
+WORKER_MAX_INFLIGHT = int(os.getenv('WORKER_MAX_INFLIGHT', 64))
+# Heroku sends SIGKILL 30 seconds after SIGTERM; finish draining before that.
+DRAIN_TIMEOUT = float(os.getenv('DRAIN_TIMEOUT', 25))
+CLAIM_TIMEOUT = 1
+# Back-off after a failed claim, doubling per consecutive failure up to the max.
+CLAIM_ERROR_BACKOFF = 1
+CLAIM_ERROR_BACKOFF_MAX = 30
+# How often each process looks for jobs and shards whose worker stopped heartbeating.
+REAP_INTERVAL = min(SHARD_LEASE_TTL, fair_queue.JOB_LEASE_TTL) / 4
+last_reap = 0.0
+
+async def set_job_status(redis_client, job_id, status):
+    await redis_client.hset(job_status_key, job_id, json.dumps(status))
+
+async def record_benchmark(redis_client, job_id):
+    # Wall-clock time from the first file started to the job's completion.
+    started_at = await redis_client.hget(progress_key(job_id), 'started_at')
+    if started_at is not None:
+        metrics.observe('job', time.time() - float(started_at))
+
+async def requeue_job(redis_client, job_data):
+    # Put the job back at the head of its queue so it is picked up first.
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.zrem(fair_queue.JOB_LEASES, job_data)
+        fair_queue.push(pipe, job_data, json.loads(job_data), head=True)
+        await pipe.execute()
+
+async def process_job(job_data, redis_client, llm_client, shutdown, inflight):
+    job = json.loads(job_data)
+    job_id = job['id']
     bucket_name = job['bucket_name']
     prefix = job.get('prefix', '')
     max_files = job.get('max_files', 100)
-    processed_files = 0
+    bypass_cache = job.get('bypass_cache', False)
+    incremental = job.get('incremental', False)
+    sink = job.get('sink')
 
     logger.info(f"Processing job: bucket={bucket_name}, prefix={prefix}, max_files={max_files}")
+    await set_job_status(redis_client, job_id, {"status": "running"})
+    await set_total(redis_client, job_id, max_files)
 
     try:
-        await run_summarize_files_from_s3(bucket_name, prefix, max_files)
-        logger.info(f"Job completed: {current_job_id}")
+        result = await run_summarize_files_from_s3(bucket_name, prefix, max_files, llm_client=llm_client,
+                                                   redis_client=redis_client, bypass_cache=bypass_cache,
+                                                   stop_event=shutdown, inflight=inflight, checkpoint_id=job_id,
+                                                   incremental=incremental, job_id=job_id, sink=sink)
+    except asyncio.CancelledError:
+        logger.warning(f"Job {job_id} did not drain in time; requeueing")
+        await requeue_job(redis_client, job_data)
+        await set_job_status(redis_client, job_id, {"status": "requeued"})
+        raise
     except Exception as e:
         logger.error(f"Error processing job: {str(e)}")
-        redis_client = redis.Redis.from_url(redis_url)
-        redis_client.hset(job_status_key, current_job_id, json.dumps({"error": str(e)}))
+        await redis_client.zrem(fair_queue.JOB_LEASES, job_data)
+        await set_job_status(redis_client, job_id, {"error": str(e)})
+        await release_dedupe(redis_client, job)
+        return
+
+    if result['stopped']:
+        logger.info(f"Job {job_id} stopped by shutdown after {result['summarized_files']} files; requeueing")
+        await requeue_job(redis_client, job_data)
+        await set_job_status(redis_client, job_id, {"status": "requeued"})
+        return
+
+    await redis_client.zrem(fair_queue.JOB_LEASES, job_data)
+    await set_job_status(redis_client, job_id, {"status": "completed", "summarized_files": result['summarized_files']})
+    await release_dedupe(redis_client, job)
+    await record_benchmark(redis_client, job_id)
+    logger.info(f"Job completed: {job_id} ({result['summarized_files']} files, LLM: {result['llm']})")
+
+async def coordinate_job(job_data, redis_client):
+    """Split a large job into shards that any worker on any node can claim."""
+    job = json.loads(job_data)
+    job_id = job['id']
+    try:
+        shard_count = await split_job(redis_client, job)
+    except asyncio.CancelledError:
+        await requeue_job(redis_client, job_data)
+        raise
+    except Exception as e:
+        logger.error(f"Error splitting job {job_id}: {str(e)}")
+        await redis_client.zrem(fair_queue.JOB_LEASES, job_data)
+        await set_job_status(redis_client, job_id, {"error": str(e)})
+        await release_dedupe(redis_client, job)
+        return
+
+    await redis_client.zrem(fair_queue.JOB_LEASES, job_data)
+    if shard_count:
+        await set_job_status(redis_client, job_id, {"status": "running", "shards": shard_count})
+    else:
+        await set_job_status(redis_client, job_id, {"status": "completed", "summarized_files": 0})
+        await release_dedupe(redis_client, job)
+
+async def process_shard(shard, redis_client, llm_client, shutdown, inflight):
+    logger.info(f"Processing shard {shard['id']}: keys ({shard['start_after']}, {shard['end_key']}]")
+    keepalive = asyncio.create_task(heartbeat(redis_client, shard['id']))
+    try:
+        result = await run_summarize_files_from_s3(shard['bucket_name'], shard['prefix'], shard['max_files'],
+                                                   llm_client=llm_client, redis_client=redis_client,
+                                                   bypass_cache=shard['bypass_cache'], stop_event=shutdown,
+                                                   inflight=inflight, start_after=shard['start_after'],
+                                                   end_key=shard['end_key'], checkpoint_id=shard['id'],
+                                                   job_id=shard['job_id'], sink=shard.get('sink'))
+    except asyncio.CancelledError:
+        await requeue_shard(redis_client, shard)
+        raise
+    except Exception as e:
+        logger.error(f"Error processing shard {shard['id']}: {str(e)}")
+        result = None
+    finally:
+        keepalive.cancel()
+
+    if result is not None and result['stopped']:
+        await requeue_shard(redis_client, shard)
+        return
+    totals = await complete_shard(redis_client, shard, result)
+    if totals is not None:
+        await set_job_status(redis_client, shard['job_id'], {"status": "completed", **totals})
+        await release_dedupe(redis_client, shard)
+        await record_benchmark(redis_client, shard['job_id'])
+        logger.info(f"Job completed: {shard['job_id']} ({totals['summarized_files']} files "
+                    f"in {totals['total']} shards, {totals['failed']} failed)")
+
+async def reap_leases(redis_client):
+    global last_reap
+    if time.monotonic() - last_reap >= REAP_INTERVAL:
+        last_reap = time.monotonic()
+        await reap_expired_leases(redis_client)
+        await fair_queue.reap_expired_jobs(redis_client)
+
+async def run_claimed(entry, redis_client, llm_client, shutdown, inflight):
+    if not fair_queue.is_job(entry):
+        shard = await load_shard(redis_client, entry)
+        if shard is not None:
+            with log_context(job_id=shard['job_id'], shard_id=shard['id']):
+                await process_shard(shard, redis_client, llm_client, shutdown, inflight)
+        return
+    if shutdown.is_set():
+        await requeue_job(redis_client, entry)
+        return
+    job = json.loads(entry)
+    # Incremental jobs list the whole prefix to find the delta, so they are not
+    # split by key range; max_files bounds the changed files, not the listing.
+    with log_context(job_id=job['id']):
+        if job.get('max_files', 100) > SHARD_SIZE and not job.get('incremental', False):
+            await coordinate_job(entry, redis_client)
+        else:
+            await process_job(entry, redis_client, llm_client, shutdown, inflight)
+
+async def claim_next(redis_client, llm_client, shutdown, inflight, rotation):
+    await reap_leases(redis_client)
+    claimed = await fair_queue.claim(redis_client, rotation.order(), SHARD_LEASES, SHARD_LEASE_TTL)
+    if claimed is None:
+        await fair_queue.wait_for_work(redis_client, CLAIM_TIMEOUT)
+        return
+    entry, tenant = claimed
+    # The entry counts against its tenant's in-flight cap until it finishes or is requeued.
+    keepalive = asyncio.create_task(fair_queue.keepalive(redis_client, tenant, entry))
+    try:
+        await run_claimed(entry, redis_client, llm_client, shutdown, inflight)
+    finally:
+        keepalive.cancel()
+        await fair_queue.release(redis_client, tenant, entry)
+
+async def claim_loop(redis_client, llm_client, shutdown, inflight):
+    rotation = fair_queue.PriorityRotation()
+    failures = 0
+    while not shutdown.is_set():
+        try:
+            await claim_next(redis_client, llm_client, shutdown, inflight, rotation)
+            failures = 0
+        except Exception as e:
+            # A lost Redis connection must not end the loop, or the process
+            # would stay up without claiming anything. Whatever was claimed
+            # keeps its lease until it expires and is reaped.
+            failures += 1
+            delay = min(CLAIM_ERROR_BACKOFF * 2 ** (failures - 1), CLAIM_ERROR_BACKOFF_MAX)
+            logger.error(f"Error in claim loop: {str(e)}; retrying in {delay:.0f}s")
+            try:
+                await asyncio.wait_for(shutdown.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+async def flush_metrics(redis_client, shutdown):
+    while not shutdown.is_set():
+        try:
+            await asyncio.wait_for(shutdown.wait(), timeout=metrics.METRICS_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        try:
+            await metrics.flush(redis_client)
+        except Exception as e:
+            logger.error(f"Error flushing metrics: {str(e)}")
 
 async def main():
-    redis_client = redis.Redis.from_url(redis_url)
-    while True:
-        _, job_data = await asyncio.to_thread(redis_client.blpop, queue_name)
-        job = json.loads(job_data)
-        await process_job(job)
-
-def handle_shutdown(signum, frame):
-    logger.info(f"Received shutdown signal: {signum}. Saving job status...")
-    if current_job_id:
-        redis_client = redis.Redis.from_url(redis_url)
-        redis_client.hset(job_status_key, current_job_id, json.dumps({"status": "stopped"}))
-    asyncio.get_event_loop().stop()
+    shutdown = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, handle_shutdown, signum, shutdown)
+
+    redis_client = redis.asyncio.Redis.from_url(redis_url)
+    # Load the tokenizer before claiming, so the first jobs do not wait for it.
+    await load_encoding()
+    inflight = asyncio.Semaphore(WORKER_MAX_INFLIGHT)
+    async with S3ClientManager(max_pool_connections=s3_pool_size(jobs=WORKER_CONCURRENCY)), LLMClient() as llm_client:
+        loops = [asyncio.create_task(claim_loop(redis_client, llm_client, shutdown, inflight))
+                 for _ in range(WORKER_CONCURRENCY)]
+        flusher = asyncio.create_task(flush_metrics(redis_client, shutdown))
+        await shutdown.wait()
+        # Stop claiming; running jobs start no new files and finish the ones in flight.
+        done, pending = await asyncio.wait(loops, timeout=DRAIN_TIMEOUT)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*loops, return_exceptions=True)
+        await flusher
+        await metrics.flush(redis_client)
+    await redis_client.aclose()
+    logger.info("Worker drained and stopped")
+
+def handle_shutdown(signum, shutdown):
+    logger.info(f"Received shutdown signal: {signum}. Draining in-flight jobs...")
+    shutdown.set()
+
+def run_process():
+    try:
+        asyncio.run(main())
+    finally:
+        # Forked children exit through os._exit, which skips atexit.
+        stop_logging()
 
 if __name__ == '__main__':
-    signal.signal(signal.SIGINT, handle_shutdown)
-    signal.signal(signal.SIGTERM, handle_shutdown)
-    asyncio.run(main())
+    if WORKER_PROCESSES <= 1:
+        run_process()
+    else:
+        # Each child runs its own event loop, clients and claim loops, and drains on
+        # its own; the parent forwards shutdown signals and waits for them.
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=run_process, name=f'worker-{i}') for i in range(WORKER_PROCESSES)]
+        for process in processes:
+            process.start()
+
+        def forward_signal(signum, frame):
+            for process in processes:
+                if process.is_alive():
+                    os.kill(process.pid, signum)
+
+        signal.signal(signal.SIGTERM, forward_signal)
+        signal.signal(signal.SIGINT, forward_signal)
+        for process in processes:
+            process.join()